@@ -18,9 +18,26 @@ BRAVE_SEARCH_API_KEY = os.getenv("BRAVE_SEARCH_API_KEY")
 # 使用するモデル
 LLM_MODEL = "gpt-5-nano"
 
+# スコアリング・興味抽出など、ユーザーに見せない判定用の軽量モデル
+LLM_MODEL_FAST = "gpt-5-nano"
+
+# 軽量モデルの推論量（"minimal"/"low"など。推論モデル以外を使う場合はNone）
+LLM_MODEL_FAST_REASONING_EFFORT = "minimal"
+
 # 最大出力トークン数
 MAX_COMPLETION_TOKENS = 2048
 
+# スコアリング・興味抽出の最大出力トークン数（JSONは100トークン未満だが、推論モデルは推論トークンも含むので余裕を持たせる）
+SCORE_MAX_TOKENS = 1024
+INTEREST_MAX_TOKENS = 1024
+
+# 思考生成・記事評価などのプロンプトに含める記憶/会話の最大文字数（入力トークン節約）
+EVAL_MEMORY_CHARS = 1500
+EVAL_CONTEXT_CHARS = 800
+
+# 最後のユーザー発言からこの秒数以上経っていたら、記事評価に最近の会話を含めない
+EVAL_CONTEXT_MAX_SILENCE = 3600
+
 # =============================================================================
 # 情報収集設定
 # =============================================================================
@@ -31,15 +48,33 @@ ENABLE_INFORMATION_GATHERING = True
 # 検索間隔（秒）- ユーザーごとにこの間隔で新しい情報を探す
 SEARCH_INTERVAL = 3600  # 1時間
 
+# 検索リクエストの開始間隔（秒）- 無料プランのレート制限対策
+SEARCH_REQUEST_INTERVAL = 2
+
 # 1回の検索で取得する記事数
 SEARCH_RESULTS_COUNT = 5
 
+# 1回のLLM呼び出しでまとめて関連性評価する記事の最大数
+ARTICLE_EVALUATION_BATCH_SIZE = 8
+
 # 情報共有の動機づけ閾値（通常の発言より高めに設定）
 INFO_SHARE_MOTIVATION_THRESHOLD = 4.0
 
 # 1日に共有する情報の最大数（ユーザーごと）
 MAX_DAILY_SHARES = 3
 
+# 既に見つけた記事URLを覚えておく最大数（ユーザーごと、古いものから忘れる）
+MAX_SEEN_URLS = 10000
+
+# 興味抽出結果のキャッシュ有効期限（秒）- 記憶が更新されたらその時点で破棄
+INTERESTS_CACHE_TTL = 3600
+
+# 記事評価のセマンティックキャッシュ（似た記事には過去の評価スコアを再利用）
+ENABLE_ARTICLE_SCORE_CACHE = True
+EMBEDDING_MODEL = "text-embedding-3-small"
+ARTICLE_SCORE_CACHE_THRESHOLD = 0.92  # コサイン類似度がこれ以上ならキャッシュヒット
+ARTICLE_SCORE_CACHE_SIZE = 200  # ユーザーごとに保持する評価済み記事の最大数
+
 # 検索対象の言語
 SEARCH_LANGUAGE = "jp"  # 日本語優先
 
@@ -67,19 +102,103 @@ MAX_CONSECUTIVE_INTERVENTIONS = 2
 # AIの発言後、次の自発的発言までの最小待機時間
 MIN_INTERVENTION_INTERVAL = 300
 
+# =============================================================================
+# 応答判定設定（返信/リアクション/無視）
+# =============================================================================
+
+# 判定に使うモデル（3択の分類なので軽量モデルで十分）と推論量（推論モデル以外を使う場合はNone）
+CLASSIFIER_MODEL = LLM_MODEL_FAST
+CLASSIFIER_REASONING_EFFORT = LLM_MODEL_FAST_REASONING_EFFORT
+
+# 判定の最大出力トークン数（JSONは50トークン程度だが、推論モデルは推論トークンも含むので余裕を持たせる）
+# まとめて判定するときは1件あたりCLASSIFIER_BATCH_ITEM_TOKENSずつ上乗せする
+CLASSIFIER_MAX_TOKENS = 512
+CLASSIFIER_BATCH_ITEM_TOKENS = 100
+
+# 判定のプロンプトに含める最近の会話の最大文字数（新しい側を残す）
+CLASSIFIER_CONTEXT_CHARS = 512
+
+# 判定のAPI呼び出しが429/5xx/接続エラーで失敗したときのリトライ回数（待ち時間はSDKが指数的に伸ばす）
+# 使い切ったら返信扱いにするので、レート制限中に無駄な返信が続かないよう少し多めにする
+CLASSIFIER_MAX_RETRIES = 3
+
+# 判定のAPI呼び出し1回あたりの制限時間（秒）。返信するかどうかの判断で長く待たせないよう、生成用よりずっと短くする
+CLASSIFIER_TIMEOUT = 10.0
+
+# 「おk」「ありがとう」「草」など明らかな短文はLLMに聞かずにルールで判定するか
+ENABLE_CLASSIFIER_RULES = True
+
+# 判定結果を覚えておく最大件数（同じメッセージ・同じ会話の流れならLLMに聞き直さない）
+CLASSIFIER_CACHE_SIZE = 1024
+
+# 短時間に届いたメッセージをまとめて1回のAPI呼び出しで判定するか（グループなど流量が多いとき向け）
+ENABLE_CLASSIFIER_BATCHING = False
+CLASSIFIER_BATCH_SIZE = 8       # 1回にまとめる最大件数
+CLASSIFIER_BATCH_WINDOW = 0.1   # 最初のメッセージからまとめて待つ最大秒数
+
+# 過去ログの再判定など急がない判定をBatch APIで行うとき、結果を確認しに行く間隔（秒）
+CLASSIFIER_OFFLINE_POLL_INTERVAL = 60
+
+# =============================================================================
+# 並行処理設定
+# =============================================================================
+
+# Proactiveサイクルを処理するワーカー数
+PROACTIVE_WORKERS = 4
+
+# 情報収集サイクルを処理するワーカー数（Brave Searchのレート制限があるため少なめ）
+INFORMATION_WORKERS = 1
+
+# ワーカーキューの最大長（溢れた分はそのサイクルでは処理しない）
+WORKER_QUEUE_SIZE = 100
+
+# 1ユーザー分のサイクル処理の制限時間（秒）
+CYCLE_TASK_TIMEOUT = 180
+
+# ユーザーメッセージへの応答で同時に実行するLLM処理の最大数
+MAX_INFLIGHT_REPLIES = 8
+
+# Proactive/情報収集サイクルで同時に実行するLLM処理の最大数（OpenAIのレート制限に合わせる）
+MAX_INFLIGHT_CYCLES = 3
+
+# OpenAI APIへの同時リクエスト数の上限（エンジン・情報収集それぞれ）
+OPENAI_CONCURRENCY = 16
+
+# Brave Search APIへの同時リクエスト数の上限
+BRAVE_CONCURRENCY = 8
+
+# Brave Searchが429/5xxを返したときのリトライ回数と初回待ち時間（秒、以降は倍々）
+BRAVE_MAX_RETRIES = 3
+BRAVE_RETRY_BASE_DELAY = 1.0
+
 # =============================================================================
 # 記憶システム設定
 # =============================================================================
 
+# 記憶の保存先（ユーザーごとにサブディレクトリを作る）
+MEMORY_DIRECTORY = "memory_store"
+
 # 短期記憶に保持する会話ターン数
 SHORT_TERM_MEMORY_SIZE = 20
 
+# 記憶抽出の間隔（メッセージ数）
+MEMORY_EXTRACTION_INTERVAL = 5
+
 # 長期記憶の最大エントリ数
 LONG_TERM_MEMORY_SIZE = 100
 
 # 思考リザーバーの最大サイズ
 THOUGHT_RESERVOIR_SIZE = 10
 
+# 関連記憶の検索にembeddingを使うか（sentence-transformersが無ければキーワード検索）
+ENABLE_EMBEDDING_RETRIEVAL = True
+
+# 記憶検索用の埋め込みモデル（記憶は日本語なので多言語モデル）
+MEMORY_EMBEDDING_MODEL = "paraphrase-multilingual-MiniLM-L12-v2"
+
+# 関連記憶とみなすコサイン類似度の下限
+MEMORY_RELEVANCE_THRESHOLD = 0.4
+
 # =============================================================================
 # 研究用設定
 # =============================================================================
@@ -92,6 +211,13 @@ LOG_DIRECTORY = "research_logs"
 # "reactive" = 従来の反応型のみ
 EXPERIMENT_CONDITION = "proactive"
 
+# ログ書き込みのバッチ設定（まとめて書き込む最大件数と待機秒数）
+LOG_BATCH_SIZE = 64
+LOG_FLUSH_INTERVAL = 0.2
+
+# メモリ上に保持するログの最大件数（全件はCSVに書き出すので、古いものから捨てる）
+MAX_IN_MEMORY_LOGS = 1000
+
 # ログに含める情報
 LOG_THOUGHTS = True          # 生成された思考をログ
 LOG_MOTIVATION_SCORES = True # 動機づけスコアをログ
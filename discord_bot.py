@@ -4,18 +4,28 @@ Inner Thoughtsフレームワークを実装したDiscord Bot
 """
 
 import asyncio
-import uuid
+import atexit
+import functools
+import logging
+import logging.handlers
+import queue
+import secrets
 from datetime import datetime
+from typing import Callable
 
+import aiohttp
 import discord
 from discord.ext import commands, tasks
+from openai import AsyncOpenAI
 
 import config
 from memory import MemoryManager
 from inner_thoughts import InnerThoughtsEngine
 from research_logger import ResearchLogger
 from information_gatherer import InformationGatherer
-from response_classifier import ResponseClassifier
+from response_classifier import BatchingClassifier, ResponseClassifier
+
+logger = logging.getLogger(__name__)
 
 
 class ProactiveAIBot(commands.Bot):
@@ -40,26 +50,64 @@ class ProactiveAIBot(commands.Bot):
             help_command=None
         )
         
+        # 共有クライアント（接続プールを使い回す）
+        self.openai_client = AsyncOpenAI(api_key=config.OPENAI_API_KEY)
+        self.http_session: aiohttp.ClientSession | None = None
+        
         # エンジン
-        self.engine = InnerThoughtsEngine()
-        self.info_gatherer = InformationGatherer()
-        self.classifier = ResponseClassifier()
+        self.engine = InnerThoughtsEngine(client=self.openai_client)
+        self.info_gatherer = InformationGatherer(client=self.openai_client)
+        self.classifier = ResponseClassifier(client=self.openai_client)
+        if config.ENABLE_CLASSIFIER_BATCHING:
+            self.classifier = BatchingClassifier(self.classifier)
         
         # ユーザーごとの記憶管理
         self.memories: dict[str, MemoryManager] = {}
         
+        # サイクル用のスナップショット（ユーザーの追加・削除時のみ作り直す）
+        self._memories_snapshot: list[tuple[str, MemoryManager]] = []
+        self._memories_dirty = False
+        
         # セッション管理
-        self.session_id = str(uuid.uuid4())[:8]
+        self.session_id = secrets.token_hex(4)
         self.logger = ResearchLogger(self.session_id)
         
         # アクティブなチャンネル（DMまたは指定チャンネル）
         self.active_channels: set[int] = set()
         
-        # 処理中フラグ（二重応答防止）
-        self.processing: set[str] = set()
+        # メンション文字列（ログイン後に設定）
+        self._mention_str = ""
+        self._mention_nick = ""
+        
+        # 処理中のメッセージID（二重応答防止）
+        self.processing: set[int] = set()
+        
+        # ユーザーごとのDMチャンネル（毎サイクルのAPI呼び出しを避ける）
+        self._dm_channels: dict[str, discord.DMChannel] = {}
         
         # 情報収集の最終検索時刻
         self.last_info_search: dict[str, datetime] = {}
+        
+        # Proactive/情報収集のワーカーキュー（キュー投入済みユーザーは重複させない）
+        self._proactive_q: asyncio.Queue[str] = asyncio.Queue(maxsize=config.WORKER_QUEUE_SIZE)
+        self._info_q: asyncio.Queue[str] = asyncio.Queue(maxsize=config.WORKER_QUEUE_SIZE)
+        self._queued_proactive: set[str] = set()
+        self._queued_info: set[str] = set()
+        self._workers: list[asyncio.Task] = []
+        
+        # キューが溢れて処理できなかった件数
+        self.dropped_jobs = 0
+        
+        # 実行中のバックグラウンドタスク（GCで消されないよう参照を保持）
+        self._bg_tasks: set[asyncio.Task] = set()
+        
+        # 研究ログの書き込みキュー（ディスクI/Oをイベントループから外す）
+        self._log_q: asyncio.Queue[Callable[[], None]] = asyncio.Queue()
+        self._log_task: asyncio.Task | None = None
+        
+        # 同時実行数の制限（OpenAIへのリクエスト集中を防ぐ）
+        self._inflight = asyncio.Semaphore(config.MAX_INFLIGHT_REPLIES)
+        self._cycle_sem = asyncio.Semaphore(config.MAX_INFLIGHT_CYCLES)
     
     # =========================================================================
     # イベントハンドラ
@@ -67,11 +115,10 @@ class ProactiveAIBot(commands.Bot):
     
     async def on_ready(self):
         """Bot起動時"""
-        print(f"🤖 {config.AI_NAME} がオンラインになりました！")
-        print(f"📊 セッションID: {self.session_id}")
-        print(f"⚙️  実験条件: {config.EXPERIMENT_CONDITION}")
-        print(f"📝 ログ保存先: {config.LOG_DIRECTORY}/")
-        print("-" * 50)
+        logger.info("🤖 %s がオンラインになりました！", config.AI_NAME)
+        logger.info("📊 セッションID: %s", self.session_id)
+        logger.info("⚙️  実験条件: %s", config.EXPERIMENT_CONDITION)
+        logger.info("📝 ログ保存先: %s/", config.LOG_DIRECTORY)
         
         # Proactiveサイクルを開始（既に動いていなければ）
         if config.EXPERIMENT_CONDITION == "proactive":
@@ -84,81 +131,102 @@ class ProactiveAIBot(commands.Bot):
         if message.author.bot:
             return
         
-        # DMまたはメンションされた場合のみ反応
-        is_dm = isinstance(message.channel, discord.DMChannel)
-        is_mentioned = self.user in message.mentions
+        # 繰り返し参照する属性はローカル変数に束縛
+        channel = message.channel
+        text = message.content
         
-        if message.content.startswith(self.command_prefix):
-            if is_dm or is_mentioned or message.content.startswith(self.command_prefix):
-                await self.process_commands(message)
+        # コマンドはどこからでも受け付ける
+        if text.startswith(self.command_prefix):
+            await self.process_commands(message)
             return
         
+        # DMまたはメンションされた場合のみ反応
+        is_dm = isinstance(channel, discord.DMChannel)
+        is_mentioned = self.user.id in message.raw_mentions
+        
         if not (is_dm or is_mentioned):
             return
         
-        # メンションを除去
-        content = message.content.replace(f"<@{self.user.id}>", "").strip()
+        # メンションを除去（ニックネーム形式 <@!id> も含む）
+        content = (
+            text
+            .replace(self._mention_str, "")
+            .replace(self._mention_nick, "")
+            .strip()
+        )
         if not content:
             return
         
         # ユーザーIDとチャンネル
         user_id = str(message.author.id)
-        channel_id = message.channel.id
+        channel_id = channel.id
+        processing = self.processing
+        research_logger = self.logger
         
-        # 二重処理防止
-        process_key = f"{user_id}:{message.id}"
-        if process_key in self.processing:
+        # 二重処理防止（メッセージIDはユーザーをまたいで一意）
+        message_id = message.id
+        if message_id in processing:
             return
-        self.processing.add(process_key)
+        processing.add(message_id)
         
         try:
             # 記憶マネージャー取得または作成
-            memory = self._get_memory(user_id)
+            memory = await self._get_memory(user_id)
             
             # チャンネルをアクティブに
             self.active_channels.add(channel_id)
             
             # ユーザーメッセージを記録
             memory.add_message("user", content)
-            self.logger.log_user_message(user_id, content)
-            
-            # 応答タイプを判定（リアクション or 返信 or 無視）
-            decision = await self.classifier.classify(
-                content,
-                memory.get_context_summary()
-            )
-            
-            if decision.action == "react" and decision.reaction:
-                # リアクションで十分な場合 → 絵文字だけ付ける
-                await message.add_reaction(decision.reaction)
-                self.logger.log_ai_response(
-                    user_id, 
-                    f"[reaction: {decision.reaction}]", 
-                    is_proactive=False,
-                    metadata={"type": "reaction", "reason": decision.reason}
+            self._log(research_logger.log_user_message, user_id, content)
+            
+            async with self._inflight:
+                # 応答タイプを判定（リアクション or 返信 or 無視）
+                # 判定中に入力中表示を並行して送っておく
+                decision, _ = await asyncio.gather(
+                    self.classifier.classify(
+                        content, memory.get_context_summary(config.CLASSIFIER_CONTEXT_CHARS)
+                    ),
+                    self._trigger_typing(channel)
                 )
-            
-            elif decision.action == "reply":
-                # 返信が必要な場合 → 通常の応答生成
-                async with message.channel.typing():
-                    response = await self.engine.generate_reactive_response(memory)
                 
-                # フォールバックメッセージは履歴に保存しない（文脈が壊れるため）
-                is_fallback = "調子悪いみたい..." in response
-                if not is_fallback:
-                    memory.add_message("assistant", response)
-                self.logger.log_ai_response(user_id, response, is_proactive=False)
+                if decision.action == "react" and decision.reaction:
+                    # リアクションで十分な場合 → 絵文字だけ付ける
+                    await message.add_reaction(decision.reaction)
+                    self._log(
+                        research_logger.log_ai_response,
+                        user_id, 
+                        f"[reaction: {decision.reaction}]", 
+                        is_proactive=False,
+                        metadata={"type": "reaction", "reason": decision.reason}
+                    )
                 
-                await message.channel.send(response)
-            
-            # else: decision.action == "none" なら何もしない
+                elif decision.action == "reply":
+                    # 返信が必要な場合 → 通常の応答生成
+                    async with channel.typing():
+                        response = await self.engine.generate_reactive_response(memory)
+                
+                    # フォールバックメッセージは履歴に保存しない（文脈が壊れるため）
+                    is_fallback = "調子悪いみたい..." in response
+                    if not is_fallback:
+                        memory.add_message("assistant", response)
+                    self._log(research_logger.log_ai_response, user_id, response, is_proactive=False)
+                
+                    await channel.send(response)
+                
+                # else: decision.action == "none" なら何もしない
             
-            # 定期的に記憶を抽出（5ターンごと）
-            if len(memory.short_term) >= 5 and len(memory.short_term) % 5 <= 1:
-                await self._extract_and_save_memories(memory)
+            # 定期的に記憶を抽出（MEMORY_EXTRACTION_INTERVALメッセージごと）
+            if memory.turns_since_extraction >= config.MEMORY_EXTRACTION_INTERVAL:
+                memory.turns_since_extraction = 0
+                
+                # 応答を待たせないようにバックグラウンドで実行
+                task = asyncio.create_task(self._extract_and_save_memories(memory))
+                self._bg_tasks.add(task)
+                task.add_done_callback(self._bg_tasks.discard)
                 
         finally:
-            self.processing.discard(process_key)
+            processing.discard(message_id)
     
     # =========================================================================
     # Proactiveサイクル
@@ -168,29 +236,54 @@ class ProactiveAIBot(commands.Bot):
     async def proactive_cycle(self):
         """
         定期的に実行されるProactiveサイクル
-        各アクティブユーザーに対して思考生成・評価を行う
+        介入可能なユーザーをキューに積み、ワーカーが並行して思考生成・評価を行う
         """
-        for user_id, memory in list(self.memories.items()):
+        for user_id, memory in self._get_memories_snapshot():
+            if memory.can_intervene():
+                self._enqueue(self._proactive_q, self._queued_proactive, user_id)
+    
+    async def _proactive_worker(self):
+        """Proactiveキューを消費するワーカー"""
+        while True:
+            user_id = await self._proactive_q.get()
             try:
-                # Proactiveサイクル実行
-                response = await self.engine.process_proactive_cycle(memory)
+                # 1人の処理が詰まってもワーカーを占有し続けないよう時間制限を付ける
+                await asyncio.wait_for(
+                    self._run_one_proactive(user_id),
+                    timeout=config.CYCLE_TASK_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                logger.warning("Proactive cycle timed out for %s", user_id)
+            except Exception:
+                logger.exception("Proactive cycle error for %s", user_id)
+            finally:
+                self._queued_proactive.discard(user_id)
+                self._proactive_q.task_done()
+    
+    async def _run_one_proactive(self, user_id: str):
+        """1ユーザー分のProactiveサイクルを実行"""
+        memory = self.memories.get(user_id)
+        if memory is None:
+            return
+        
+        # Proactiveサイクル実行
+        async with self._cycle_sem:
+            response = await self.engine.process_proactive_cycle(memory)
+        
+        if response:
+            # 発言先のチャンネルを探す
+            channel = await self._get_channel_for_user(user_id)
+            if channel:
+                # 記録
+                memory.add_message("assistant", response)
+                self._log(
+                    self.logger.log_ai_response,
+                    user_id, response, is_proactive=True,
+                    metadata={"trigger": "proactive_cycle"}
+                )
                 
-                if response:
-                    # 発言先のチャンネルを探す
-                    channel = await self._get_channel_for_user(user_id)
-                    if channel:
-                        # 記録
-                        memory.add_message("assistant", response)
-                        self.logger.log_ai_response(
-                            user_id, response, is_proactive=True,
-                            metadata={"trigger": "proactive_cycle"}
-                        )
-                        
-                        # 送信
-                        await channel.send(response)
-                        
-            except Exception as e:
-                print(f"Proactive cycle error for {user_id}: {e}")
+                # 送信
+                await self._send_dm(user_id, channel, response)
     
     @proactive_cycle.before_loop
     async def before_proactive_cycle(self):
@@ -206,59 +299,82 @@ class ProactiveAIBot(commands.Bot):
     async def information_gathering_cycle(self):
         """
         定期的に実行される情報収集サイクル
-        各ユーザーの興味に基づいて情報を探し、共有する
+        検索対象のユーザーをキューに積み、ワーカーが情報を探して共有する
         """
         if not config.BRAVE_SEARCH_API_KEY:
             return
         
         now = datetime.now()
         
-        for user_id, memory in list(self.memories.items()):
-            try:
-                # 検索間隔チェック
-                last_search = self.last_info_search.get(user_id)
-                if last_search:
-                    elapsed = (now - last_search).total_seconds()
-                    if elapsed < config.SEARCH_INTERVAL:
-                        continue
-                
-                # 長期記憶がないユーザーはスキップ
-                if not memory.long_term:
+        for user_id, memory in self._get_memories_snapshot():
+            # 検索間隔チェック
+            last_search = self.last_info_search.get(user_id)
+            if last_search:
+                elapsed = (now - last_search).total_seconds()
+                if elapsed < config.SEARCH_INTERVAL:
                     continue
+            
+            # 長期記憶がないユーザーはスキップ
+            if not memory.long_term:
+                continue
+            
+            # 介入可能かチェック
+            if not memory.can_intervene():
+                continue
+            
+            self._enqueue(self._info_q, self._queued_info, user_id)
+    
+    async def _information_worker(self):
+        """情報収集キューを消費するワーカー"""
+        while True:
+            user_id = await self._info_q.get()
+            try:
+                await asyncio.wait_for(
+                    self._run_one_information_share(user_id),
+                    timeout=config.CYCLE_TASK_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                logger.warning("Information gathering timed out for %s", user_id)
+            except Exception:
+                logger.exception("Information gathering error for %s", user_id)
+            finally:
+                self._queued_info.discard(user_id)
+                self._info_q.task_done()
+    
+    async def _run_one_information_share(self, user_id: str):
+        """1ユーザー分の情報収集・共有を実行"""
+        memory = self.memories.get(user_id)
+        if memory is None:
+            return
+        
+        # 情報を探す
+        async with self._cycle_sem:
+            result = await self.info_gatherer.find_shareable_article(memory)
+        
+        if result:
+            article, message = result
+            
+            # チャンネルを取得
+            channel = await self._get_channel_for_user(user_id)
+            if channel:
+                # 記録
+                memory.add_message("assistant", message)
+                self._log(
+                    self.logger.log_ai_response,
+                    user_id, message, is_proactive=True,
+                    metadata={
+                        "trigger": "information_share",
+                        "article_title": article.title,
+                        "article_url": article.url,
+                        "relevance_score": article.relevance_score
+                    }
+                )
                 
-                # 介入可能かチェック
-                if not memory.can_intervene():
-                    continue
-                
-                # 情報を探す
-                result = await self.info_gatherer.find_shareable_article(memory)
-                
-                if result:
-                    article, message = result
-                    
-                    # チャンネルを取得
-                    channel = await self._get_channel_for_user(user_id)
-                    if channel:
-                        # 記録
-                        memory.add_message("assistant", message)
-                        self.logger.log_ai_response(
-                            user_id, message, is_proactive=True,
-                            metadata={
-                                "trigger": "information_share",
-                                "article_title": article.title,
-                                "article_url": article.url,
-                                "relevance_score": article.relevance_score
-                            }
-                        )
-                        
-                        # 送信
-                        await channel.send(message)
-                
-                # 検索時刻を更新
-                self.last_info_search[user_id] = now
-                        
-            except Exception as e:
-                print(f"Information gathering error for {user_id}: {e}")
+                # 送信
+                await self._send_dm(user_id, channel, message)
+        
+        # 検索時刻を更新
+        self.last_info_search[user_id] = datetime.now()
     
     @information_gathering_cycle.before_loop
     async def before_information_gathering_cycle(self):
@@ -271,26 +387,74 @@ class ProactiveAIBot(commands.Bot):
     
     async def setup_hook(self):
         """コマンドの設定"""
+        # 同期的に完了するコルーチンではTaskを生成しない（Python 3.12+）
+        if hasattr(asyncio, "eager_task_factory"):
+            asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+        
+        # メンション除去用の文字列（setup_hookはログイン後に呼ばれる）
+        self._mention_str = f"<@{self.user.id}>"
+        self._mention_nick = f"<@!{self.user.id}>"
+        
+        # 外部API用のHTTPセッション（ClientSessionはイベントループ内で作る）
+        self.http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=100, limit_per_host=20, ttl_dns_cache=300)
+        )
+        self.info_gatherer.session = self.http_session
+        
+        # ログ書き込みタスクを起動
+        self._log_task = asyncio.create_task(self._log_writer())
+        
+        # サイクル用のワーカーを起動
+        self._workers = [
+            asyncio.create_task(self._proactive_worker())
+            for _ in range(config.PROACTIVE_WORKERS)
+        ] + [
+            asyncio.create_task(self._information_worker())
+            for _ in range(config.INFORMATION_WORKERS)
+        ]
+        
+        # 実行中に変わらない埋め込みは起動時に一度だけ組み立てる
+        status_template = discord.Embed(
+            title=f"📊 {config.AI_NAME} ステータス",
+            color=discord.Color.blue()
+        )
+        status_template.add_field(
+            name="セッション",
+            value=f"ID: `{self.session_id}`\n条件: `{config.EXPERIMENT_CONDITION}`",
+            inline=False
+        )
+        
+        config_template = discord.Embed(
+            title="⚙️ 現在の設定",
+            color=discord.Color.orange()
+        )
+        config_template.add_field(
+            name="Proactive設定",
+            value=f"動機づけ閾値: {config.MOTIVATION_THRESHOLD}\n"
+                  f"思考生成間隔: {config.THOUGHT_GENERATION_INTERVAL}秒\n"
+                  f"沈黙タイムアウト: {config.SILENCE_TIMEOUT}秒\n"
+                  f"最大連続発言: {config.MAX_CONSECUTIVE_INTERVENTIONS}回",
+            inline=False
+        )
+        config_template.add_field(
+            name="情報収集設定",
+            value=f"有効: {config.ENABLE_INFORMATION_GATHERING}\n"
+                  f"検索間隔: {config.SEARCH_INTERVAL}秒\n"
+                  f"共有閾値: {config.INFO_SHARE_MOTIVATION_THRESHOLD}\n"
+                  f"1日の最大共有: {config.MAX_DAILY_SHARES}回",
+            inline=False
+        )
         
         @self.command(name="status")
         async def status(ctx):
             """現在のステータスを表示"""
             user_id = str(ctx.author.id)
-            memory = self._get_memory(user_id)
+            memory = await self._get_memory(user_id)
             
             stats = self.logger.get_thought_statistics()
             metrics = self.logger.calculate_metrics(user_id)
             
-            embed = discord.Embed(
-                title=f"📊 {config.AI_NAME} ステータス",
-                color=discord.Color.blue()
-            )
-            
-            embed.add_field(
-                name="セッション",
-                value=f"ID: `{self.session_id}`\n条件: `{config.EXPERIMENT_CONDITION}`",
-                inline=False
-            )
+            embed = status_template.copy()
             
             embed.add_field(
                 name="会話統計",
@@ -324,7 +488,7 @@ class ProactiveAIBot(commands.Bot):
         async def show_memories(ctx):
             """覚えていることを表示"""
             user_id = str(ctx.author.id)
-            memory = self._get_memory(user_id)
+            memory = await self._get_memory(user_id)
             
             memories_text = memory.get_all_memories_summary()
             
@@ -340,8 +504,9 @@ class ProactiveAIBot(commands.Bot):
         async def forget_memories(ctx):
             """記憶をリセット"""
             user_id = str(ctx.author.id)
-            if user_id in self.memories:
-                del self.memories[user_id]
+            self.memories.pop(user_id, None)
+            self._memories_dirty = True
+            self._dm_channels.pop(user_id, None)
             
             await ctx.send("記憶をリセットしました。また一から仲良くなりましょう！")
         
@@ -349,7 +514,7 @@ class ProactiveAIBot(commands.Bot):
         async def show_thoughts(ctx):
             """保留中の思考を表示（デバッグ用）"""
             user_id = str(ctx.author.id)
-            memory = self._get_memory(user_id)
+            memory = await self._get_memory(user_id)
             
             pending = memory.get_pending_thoughts()
             
@@ -384,36 +549,13 @@ class ProactiveAIBot(commands.Bot):
         @self.command(name="config")
         async def show_config(ctx):
             """設定を表示"""
-            embed = discord.Embed(
-                title="⚙️ 現在の設定",
-                color=discord.Color.orange()
-            )
-            
-            embed.add_field(
-                name="Proactive設定",
-                value=f"動機づけ閾値: {config.MOTIVATION_THRESHOLD}\n"
-                      f"思考生成間隔: {config.THOUGHT_GENERATION_INTERVAL}秒\n"
-                      f"沈黙タイムアウト: {config.SILENCE_TIMEOUT}秒\n"
-                      f"最大連続発言: {config.MAX_CONSECUTIVE_INTERVENTIONS}回",
-                inline=False
-            )
-            
-            embed.add_field(
-                name="情報収集設定",
-                value=f"有効: {config.ENABLE_INFORMATION_GATHERING}\n"
-                      f"検索間隔: {config.SEARCH_INTERVAL}秒\n"
-                      f"共有閾値: {config.INFO_SHARE_MOTIVATION_THRESHOLD}\n"
-                      f"1日の最大共有: {config.MAX_DAILY_SHARES}回",
-                inline=False
-            )
-            
-            await ctx.send(embed=embed)
+            await ctx.send(embed=config_template.copy())
             
         @self.command(name="interests")
         async def show_interests(ctx):
             """推測された興味を表示"""
             user_id = str(ctx.author.id)
-            memory = self._get_memory(user_id)
+            memory = await self._get_memory(user_id)
             
             async with ctx.typing():
                 interests = await self.info_gatherer.extract_interests(memory)
@@ -442,7 +584,7 @@ class ProactiveAIBot(commands.Bot):
                 return
             
             user_id = str(ctx.author.id)
-            memory = self._get_memory(user_id)
+            memory = await self._get_memory(user_id)
             
             await ctx.send("🔍 あなたが興味ありそうな情報を探しています...")
             
@@ -454,7 +596,8 @@ class ProactiveAIBot(commands.Bot):
                 
                 # 記録
                 memory.add_message("assistant", message)
-                self.logger.log_ai_response(
+                self._log(
+                    self.logger.log_ai_response,
                     user_id, message, is_proactive=True,
                     metadata={
                         "trigger": "manual_search",
@@ -470,7 +613,9 @@ class ProactiveAIBot(commands.Bot):
         @self.command(name="export")
         async def export_logs(ctx):
             """ログをエクスポート"""
-            self.logger.save_session_summary()
+            # キューに溜まったログを書き終えてからサマリーを保存する
+            self._log_q.put_nowait(self.logger.save_session_summary)
+            await self._log_q.join()
             
             summary = self.logger.export_session_summary()
             
@@ -500,12 +645,24 @@ class ProactiveAIBot(commands.Bot):
                 await ctx.send("DMでのみ使えます")
                 return
             
-            deleted = 0
-            async for message in ctx.channel.history(limit=limit):
-                if message.author == self.user:
-                    await message.delete()
-                    deleted += 1
-                    await asyncio.sleep(0.5)  # レート制限対策
+            # DMは一括削除に対応していないため、並行して1件ずつ削除する
+            # （レート制限はライブラリ側で待機してくれる）
+            messages = [
+                message async for message in ctx.channel.history(limit=limit)
+                if message.author == self.user
+            ]
+            sem = asyncio.Semaphore(5)
+            
+            async def delete(message: discord.Message) -> bool:
+                async with sem:
+                    try:
+                        await message.delete()
+                        return True
+                    except discord.HTTPException:
+                        return False
+            
+            results = await asyncio.gather(*(delete(m) for m in messages))
+            deleted = sum(results)
             
             await ctx.send(f"🧹 {deleted}件削除しました", delete_after=5)
     
@@ -513,42 +670,158 @@ class ProactiveAIBot(commands.Bot):
     # ヘルパー関数
     # =========================================================================
     
-    def _get_memory(self, user_id: str) -> MemoryManager:
+    def _log(self, method: Callable, *args, **kwargs):
+        """研究ログの書き込みをキューに積む（書き込みは後になるので、発生時刻をここで記録して渡す）"""
+        kwargs.setdefault("timestamp", datetime.now())
+        self._log_q.put_nowait(functools.partial(method, *args, **kwargs))
+    
+    async def _log_writer(self):
+        """ログキューをまとめて取り出し、スレッドプールで書き込む"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._log_q.get()]
+            
+            # 少し待ってからまとめて書き込む
+            await asyncio.sleep(config.LOG_FLUSH_INTERVAL)
+            while len(batch) < config.LOG_BATCH_SIZE and not self._log_q.empty():
+                batch.append(self._log_q.get_nowait())
+            
+            try:
+                await loop.run_in_executor(None, self._write_logs, batch)
+            finally:
+                for _ in batch:
+                    self._log_q.task_done()
+    
+    def _write_logs(self, batch: list[Callable[[], None]]):
+        """ログを順番に書き込み、バッチごとにまとめてflushする（スレッドプール上で実行）"""
+        for write in batch:
+            try:
+                write()
+            except Exception:
+                logger.exception("Research log error")
+        try:
+            self.logger.flush()
+        except Exception:
+            logger.exception("Research log error")
+    
+    def _enqueue(self, queue: asyncio.Queue, queued: set[str], user_id: str):
+        """ユーザーをワーカーキューに積む（投入済みならスキップ、満杯なら破棄）"""
+        if user_id in queued:
+            return
+        try:
+            queue.put_nowait(user_id)
+        except asyncio.QueueFull:
+            self.dropped_jobs += 1
+            return
+        queued.add(user_id)
+    
+    async def _get_memory(self, user_id: str) -> MemoryManager:
         """ユーザーの記憶マネージャーを取得または作成"""
-        if user_id not in self.memories:
-            self.memories[user_id] = MemoryManager(user_id)
-        return self.memories[user_id]
+        memory = self.memories.get(user_id)
+        if memory is None:
+            # ディスクからの読み込み（embeddingの再計算を含む）はイベントループの外で行う
+            memory = await asyncio.to_thread(MemoryManager, user_id)
+            # 読み込み中に同じユーザーの分が作られていたらそちらを使う
+            if user_id in self.memories:
+                return self.memories[user_id]
+            self.memories[user_id] = memory
+            self._memories_dirty = True
+        return memory
+    
+    def _get_memories_snapshot(self) -> list[tuple[str, MemoryManager]]:
+        """サイクルで走査する (user_id, memory) の一覧を取得"""
+        if self._memories_dirty:
+            self._memories_snapshot = list(self.memories.items())
+            self._memories_dirty = False
+        return self._memories_snapshot
     
     async def _get_channel_for_user(self, user_id: str):
         """ユーザーに送信するチャンネルを取得"""
+        channel = self._dm_channels.get(user_id)
+        if channel is not None:
+            return channel
+        
         try:
-            user = await self.fetch_user(int(user_id))
-            return user.dm_channel or await user.create_dm()
+            # キャッシュにいればREST APIを呼ばない
+            user = self.get_user(int(user_id)) or await self.fetch_user(int(user_id))
+            channel = user.dm_channel or await user.create_dm()
         except Exception:
             return None
+        
+        self._dm_channels[user_id] = channel
+        return channel
+    
+    async def _trigger_typing(self, channel: discord.abc.Messageable):
+        """入力中表示を1回だけ送信（失敗しても無視）"""
+        try:
+            await channel.typing()
+        except discord.HTTPException:
+            pass
+    
+    async def _send_dm(self, user_id: str, channel: discord.DMChannel, content: str):
+        """DMを送信（失敗したらキャッシュしたチャンネルを破棄）"""
+        try:
+            await channel.send(content)
+        except discord.HTTPException:
+            self._dm_channels.pop(user_id, None)
+            raise
     
     async def _extract_and_save_memories(self, memory: MemoryManager):
         """記憶を抽出して保存"""
         try:
-            print(f"[DEBUG] Extracting memories...")
+            logger.debug("Extracting memories...")
             new_memories = await self.engine.extract_memories(memory)
-            print(f"[DEBUG] Extracted {len(new_memories)} memories: {new_memories}")
+            logger.debug("Extracted %d memories: %s", len(new_memories), new_memories)
             for mem in new_memories:
-                memory.add_long_term_memory(
+                await memory.add_long_term_memory(
                     key=mem.get("key", "その他"),
                     content=mem.get("content", ""),
                     importance=mem.get("importance", 3.0)
                 )
-        except Exception as e:
-            print(f"Memory extraction error: {e}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            logger.exception("Memory extraction error")
+    
+    async def close(self):
+        """Bot終了時にワーカーと接続を停止"""
+        # 未書き込みのログを書き切る
+        if self._log_task and not self._log_task.done():
+            await self._log_q.join()
+            self._log_task.cancel()
+        self.logger.close()
+        
+        for worker in self._workers:
+            worker.cancel()
+        if isinstance(self.classifier, BatchingClassifier):
+            self.classifier.close()
+        
+        await self.info_gatherer.close()
+        if self.http_session:
+            await self.http_session.close()
+        await self.openai_client.close()
+        await super().close()
 
 
 # =============================================================================
 # メイン
 # =============================================================================
 
+def setup_logging():
+    """ログ出力をキュー経由にし、書き込みを別スレッドで行う"""
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(
+        "%(asctime)s %(levelname)s %(name)s: %(message)s"
+    ))
+    
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+
+
 def main():
     """Botを起動"""
     if not config.DISCORD_TOKEN:
@@ -561,8 +834,11 @@ def main():
         print("   .env ファイルに OPENAI_API_KEY=your_key を追加してください")
         return
     
+    setup_logging()
+    
     bot = ProactiveAIBot()
-    bot.run(config.DISCORD_TOKEN)
+    # discord.pyのログもルートロガー（キュー）に流す
+    bot.run(config.DISCORD_TOKEN, log_handler=None)
 
 
 if __name__ == "__main__":
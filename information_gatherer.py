@@ -4,14 +4,76 @@ Proactive AI Friend - Information Gatherer
 """
 
 import aiohttp
-import json
-from datetime import datetime, timedelta
-from typing import Optional
+import asyncio
+import functools
+import hashlib
+import os
+import time
+import numpy as np
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import AsyncIterator, Optional
 from dataclasses import dataclass, asdict
 from openai import AsyncOpenAI
 
 import config
-from memory import MemoryManager
+from json_utils import dumps, loads
+from llm_utils import FAST_MODEL_OPTIONS, create_completion, dedup_call, single_chunk, stream_text
+from memory import MemoryManager, _append_text, _replace_file, _submit_save
+
+
+# =============================================================================
+# プロンプト（固定の指示はsystemメッセージとして先頭に置き、プロンプトキャッシュを効かせる）
+# =============================================================================
+
+INTEREST_EXTRACTION_SYSTEM = """
+与えられたユーザー情報から、検索に使えそうな「興味・関心」を抽出してください。
+
+## タスク
+- ユーザーが興味を持っていそうなトピックを3-5個抽出
+- 検索クエリとして使えるように、具体的なキーワードで
+- 一般的すぎるもの（音楽、映画など）は避け、具体的に
+
+## 出力形式（JSON）
+{"interests": ["キーワード1", "キーワード2", "キーワード3"]}
+
+例: {"interests": ["Apple 新製品", "機械学習 最新研究", "京都 カフェ"]}
+"""
+
+ARTICLE_EVALUATION_SYSTEM = """
+与えられた各記事を、このユーザーに共有すべきかどうか評価してください。
+
+## 評価基準（各1-5点）
+1. 関連性: ユーザーの興味とどれくらいマッチするか
+2. 新鮮さ: 新しい情報・発見がありそうか
+3. 会話価値: これを共有したら会話が盛り上がりそうか
+4. 信頼性: ソースは信頼できそうか
+5. タイミング: 今共有するのは適切か
+
+## 出力形式（JSON）
+記事ごとに、記事番号と上記を踏まえた1-5の総合評価を返してください。
+{
+    "scores": [
+        {"id": 0, "overall_score": 4},
+        {"id": 1, "overall_score": 2}
+    ]
+}
+"""
+
+SHARE_MESSAGE_SYSTEM = """
+友達に面白い記事を教えるような感じで、与えられた記事を共有するメッセージを作ってください。
+
+## 重要なルール
+- 押し付けがましくなく、自然に
+- 「ねえねえ」「そういえば」「見つけたんだけど」など自然な導入
+- URLは必ず含める
+- 2-3文程度で短く
+- 相手の興味に関連付けて紹介
+- 質問で終わらなくてもOK
+
+## 出力
+メッセージ本文のみ（説明不要）
+"""
 
 
 @dataclass
@@ -42,61 +104,99 @@ class InformationGatherer:
     - 自然な共有メッセージを生成
     """
     
-    def __init__(self):
-        self.client = AsyncOpenAI(api_key=config.OPENAI_API_KEY)
+    def __init__(
+        self,
+        client: Optional[AsyncOpenAI] = None,
+        session: Optional[aiohttp.ClientSession] = None
+    ):
+        self.client = client or AsyncOpenAI(api_key=config.OPENAI_API_KEY)
         self.brave_api_key = config.BRAVE_SEARCH_API_KEY
         
-        # ユーザーごとの記事キャッシュ（既に見つけた記事のURL）
-        self.seen_urls: dict[str, set[str]] = {}
+        # 多数のユーザー分を並行処理しても外部APIに一斉にリクエストしない
+        self._openai_sem = asyncio.Semaphore(config.OPENAI_CONCURRENCY)
+        self._brave_sem = asyncio.Semaphore(config.BRAVE_CONCURRENCY)
+        
+        # 共有HTTPセッション（未設定なら初回検索時に作って使い回す）
+        self.session = session
+        self._owns_session = False
+        
+        # ユーザーごとの記事キャッシュ（既に見つけた記事URLの64bitハッシュ、LRU順）
+        # 記憶と同じディレクトリの seen_urls.log に追記し、初回アクセス時に読み込む
+        self.seen_urls: dict[str, OrderedDict[int, None]] = {}
+        
+        # seen_urls.log の行数。増えすぎたら今の一覧だけに書き直す
+        self._seen_log_size: dict[str, int] = {}
+        
+        # ユーザーごとの共有数（日付の序数, その日の共有数）
+        self._share_state: dict[str, tuple[int, int]] = {}
         
-        # ユーザーごとの本日の共有数
-        self.daily_shares: dict[str, int] = {}
-        self.last_share_reset: dict[str, datetime] = {}
+        # ユーザーごとの興味キャッシュ（取得時刻, 記憶要約のハッシュ, 興味リスト）
+        self._interests_cache: dict[str, tuple[float, bytes, list[str]]] = {}
+        
+        # ユーザーごとの記事評価キャッシュ（正規化済みembedding行列, スコア）
+        self._score_cache: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        
+        # 実行中のLLMリクエスト（リクエスト内容のハッシュ → 結果のFuture）
+        self._inflight: dict[str, asyncio.Future] = {}
     
     # =========================================================================
     # 興味の抽出
     # =========================================================================
     
-    async def extract_interests(self, memory: MemoryManager) -> list[str]:
+    async def extract_interests(
+        self, 
+        memory: MemoryManager, 
+        memories_summary: Optional[str] = None
+    ) -> list[str]:
         """
         長期記憶からユーザーの興味を抽出
+        
+        memories_summaryを渡せば、記憶の要約を作り直さずにそれを使う
         """
-        memories_summary = memory.get_all_memories_summary()
+        if memories_summary is None:
+            memories_summary = memory.get_all_memories_summary(config.EVAL_MEMORY_CHARS)
         
         if not memories_summary or memories_summary == "まだユーザーについての情報がありません。":
             return []
         
+        # 記憶が変わっておらず、有効期限内ならキャッシュを返す
+        digest = hashlib.blake2b(memories_summary.encode(), digest_size=16).digest()
+        cached = self._interests_cache.get(memory.user_id)
+        if (
+            cached
+            and cached[1] == digest
+            and time.monotonic() - cached[0] < config.INTERESTS_CACHE_TTL
+        ):
+            return cached[2]
+        
         prompt = f"""
-以下のユーザー情報から、検索に使えそうな「興味・関心」を抽出してください。
-
 ## ユーザー情報
 {memories_summary}
-
-## タスク
-- ユーザーが興味を持っていそうなトピックを3-5個抽出
-- 検索クエリとして使えるように、具体的なキーワードで
-- 一般的すぎるもの（音楽、映画など）は避け、具体的に
-
-## 出力形式（JSON配列）
-["キーワード1", "キーワード2", "キーワード3"]
-
-例: ["Apple 新製品", "機械学習 最新研究", "京都 カフェ"]
 """
         
         try:
-            response = await self.client.chat.completions.create(
-                model=config.LLM_MODEL,
-                max_completion_tokens=config.MAX_COMPLETION_TOKENS,
-                messages=[{"role": "user", "content": prompt}]
-            )
+            # 同じ内容のリクエストが実行中なら、新たに呼ばずにその結果を待つ
+            key = self._request_key(config.LLM_MODEL_FAST, INTEREST_EXTRACTION_SYSTEM, prompt)
+            response = await dedup_call(self._inflight, key, lambda: create_completion(
+                self.client, self._openai_sem,
+                model=config.LLM_MODEL_FAST,
+                max_completion_tokens=config.INTEREST_MAX_TOKENS,
+                response_format={"type": "json_object"},
+                **FAST_MODEL_OPTIONS,
+                messages=[
+                    {"role": "system", "content": INTEREST_EXTRACTION_SYSTEM},
+                    {"role": "user", "content": prompt}
+                ]
+            ))
             
-            text = response.choices[0].message.content
-            # JSON抽出
-            import re
-            match = re.search(r'\[.*?\]', text, re.DOTALL)
-            if match:
-                return json.loads(match.group())
-            return []
+            # JSONモードなので応答全体をそのままパースできる
+            data = loads(response.choices[0].message.content or "{}")
+            interests = [i for i in data.get("interests", []) if isinstance(i, str)]
+            if interests:
+                self._interests_cache[memory.user_id] = (
+                    time.monotonic(), digest, interests
+                )
+            return interests
             
         except Exception as e:
             print(f"Interest extraction error: {e}")
@@ -127,14 +227,25 @@ class InformationGatherer:
         }
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers, params=params) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        return data.get("web", {}).get("results", [])
-                    else:
-                        print(f"Brave Search error: {resp.status}")
-                        return []
+            session = self._get_session()
+            for attempt in range(config.BRAVE_MAX_RETRIES + 1):
+                async with self._brave_sem:
+                    async with session.get(url, headers=headers, params=params) as resp:
+                        if resp.status == 200:
+                            data = await resp.json(loads=loads)
+                            return data.get("web", {}).get("results", [])
+                        status = resp.status
+                        retry_after = resp.headers.get("Retry-After", "")
+                
+                # レート制限・サーバーエラーのみ指数バックオフで再試行（待つ間は枠を空ける）
+                if (status != 429 and status < 500) or attempt == config.BRAVE_MAX_RETRIES:
+                    print(f"Brave Search error: {status}")
+                    return []
+                if retry_after.isdigit():
+                    delay = float(retry_after)
+                else:
+                    delay = config.BRAVE_RETRY_BASE_DELAY * 2 ** attempt
+                await asyncio.sleep(delay)
         except Exception as e:
             print(f"Brave Search request error: {e}")
             return []
@@ -142,7 +253,8 @@ class InformationGatherer:
     async def search_for_user(
         self, 
         memory: MemoryManager, 
-        interests: Optional[list[str]] = None
+        interests: Optional[list[str]] = None,
+        memories_summary: Optional[str] = None
     ) -> list[Article]:
         """
         ユーザーの興味に基づいて検索し、新しい記事を返す
@@ -151,33 +263,42 @@ class InformationGatherer:
         
         # 興味がなければ抽出
         if not interests:
-            interests = await self.extract_interests(memory)
+            interests = await self.extract_interests(memory, memories_summary)
         
         if not interests:
             return []
         
-        # 既知URLのセット
-        if user_id not in self.seen_urls:
-            self.seen_urls[user_id] = set()
+        # 既知URL
+        await self._load_share_state(user_id)
+        seen = self.seen_urls[user_id]
+        touched: list[int] = []  # 新しく見つけた・再び見かけたURL（LRU順の変化を追記する）
         
         articles = []
+        queries = interests[:3]  # 最大3つの興味で検索
         
-        import asyncio
-        for i, interest in enumerate(interests[:3]):  # 最大3つの興味で検索
+        async def search(i: int, query: str) -> list[dict]:
+            # 無料プランのレート制限対策: 開始時刻をずらして並行実行
             if i > 0:
-                # 無料プランのレート制限対策: 2秒待機
-                await asyncio.sleep(2)
-            
-            results = await self.search_brave(interest)
-            
+                await asyncio.sleep(i * config.SEARCH_REQUEST_INTERVAL)
+            return await self.search_brave(query)
+        
+        results_lists = await asyncio.gather(
+            *(search(i, q) for i, q in enumerate(queries))
+        )
+        
+        # 重複除去は結果が揃ってからまとめて行う
+        for interest, results in zip(queries, results_lists):
             for result in results:
                 url = result.get("url", "")
+                key = self._url_key(url)
                 
                 # 既に見つけたURLはスキップ
-                if url in self.seen_urls[user_id]:
+                touched.append(key)
+                if key in seen:
+                    seen.move_to_end(key)
                     continue
                 
-                self.seen_urls[user_id].add(url)
+                seen[key] = None
                 
                 article = Article(
                     title=result.get("title", ""),
@@ -190,76 +311,91 @@ class InformationGatherer:
                 )
                 articles.append(article)
         
+        # 古いURLから忘れる
+        while len(seen) > config.MAX_SEEN_URLS:
+            seen.popitem(last=False)
+        
+        if touched:
+            self._save_seen_urls(user_id, touched)
+        
         return articles
     
     # =========================================================================
     # 関連性評価
     # =========================================================================
     
-    async def evaluate_article_relevance(
+    async def evaluate_articles_relevance(
         self, 
-        article: Article, 
-        memory: MemoryManager
-    ) -> float:
+        articles: list[Article], 
+        memory: MemoryManager,
+        memories_summary: Optional[str] = None,
+        conversation_context: Optional[str] = None
+    ) -> list[float]:
         """
-        記事がユーザーにとってどれくらい関連性があるかスコアリング
+        複数の記事がユーザーにとってどれくらい関連性があるか、1回の呼び出しでまとめてスコアリング
+        
+        memories_summary / conversation_contextを渡せば、作り直さずにそれを使う
+        
+        Returns:
+            articlesと同じ順のスコア（評価できなかった記事は0）
         """
-        memories_summary = memory.get_all_memories_summary()
-        conversation_context = memory.get_context_summary()
+        if memories_summary is None:
+            memories_summary = memory.get_all_memories_summary(config.EVAL_MEMORY_CHARS)
+        if conversation_context is None:
+            conversation_context = self._evaluation_context(memory)
+        
+        article_list = "\n\n".join(
+            f"[{i}]\n"
+            f"タイトル: {article.title}\n"
+            f"説明: {article.description}\n"
+            f"ソース: {article.source}\n"
+            f"検索クエリ: {article.search_query}"
+            for i, article in enumerate(articles)
+        )
         
         prompt = f"""
-以下の記事を、このユーザーに共有すべきかどうか評価してください。
-
 ## 記事
-タイトル: {article.title}
-説明: {article.description}
-ソース: {article.source}
-検索クエリ: {article.search_query}
+{article_list}
 
 ## ユーザー情報
 {memories_summary}
 
 ## 最近の会話
 {conversation_context}
-
-## 評価基準（各1-5点）
-1. 関連性: ユーザーの興味とどれくらいマッチするか
-2. 新鮮さ: 新しい情報・発見がありそうか
-3. 会話価値: これを共有したら会話が盛り上がりそうか
-4. 信頼性: ソースは信頼できそうか
-5. タイミング: 今共有するのは適切か
-
-## 出力形式（JSON）
-{{
-    "relevance": 1-5,
-    "freshness": 1-5,
-    "conversation_value": 1-5,
-    "reliability": 1-5,
-    "timing": 1-5,
-    "overall_score": 1-5の総合評価,
-    "reasoning": "評価理由（1文）"
-}}
 """
         
         try:
-            response = await self.client.chat.completions.create(
-                model=config.LLM_MODEL,
-                max_completion_tokens=config.MAX_COMPLETION_TOKENS,
-                messages=[{"role": "user", "content": prompt}]
-            )
+            # 同じ内容のリクエストが実行中なら、新たに呼ばずにその結果を待つ
+            key = self._request_key(config.LLM_MODEL_FAST, ARTICLE_EVALUATION_SYSTEM, prompt)
+            response = await dedup_call(self._inflight, key, lambda: create_completion(
+                self.client, self._openai_sem,
+                model=config.LLM_MODEL_FAST,
+                max_completion_tokens=config.SCORE_MAX_TOKENS,
+                response_format={"type": "json_object"},
+                **FAST_MODEL_OPTIONS,
+                messages=[
+                    {"role": "system", "content": ARTICLE_EVALUATION_SYSTEM},
+                    {"role": "user", "content": prompt}
+                ]
+            ))
             
-            text = response.choices[0].message.content
-            # JSON抽出
-            import re
-            match = re.search(r'\{.*?\}', text, re.DOTALL)
-            if match:
-                result = json.loads(match.group())
-                return result.get("overall_score", 0)
-            return 0
+            # JSONモードなので応答全体をそのままパースできる
+            data = loads(response.choices[0].message.content or "{}")
+            
+            scores = [0] * len(articles)
+            for item in data.get("scores", []):
+                article_id = item.get("id")
+                if isinstance(article_id, int) and 0 <= article_id < len(articles):
+                    # nullや文字列のスコアが返ってきても後の比較で落ちないよう数値にする
+                    try:
+                        scores[article_id] = float(item.get("overall_score", 0))
+                    except (TypeError, ValueError):
+                        scores[article_id] = 0
+            return scores
             
         except Exception as e:
             print(f"Article evaluation error: {e}")
-            return 0
+            return [0] * len(articles)
     
     # =========================================================================
     # 共有メッセージ生成
@@ -268,16 +404,20 @@ class InformationGatherer:
     async def generate_share_message(
         self, 
         article: Article, 
-        memory: MemoryManager
-    ) -> str:
+        memory: MemoryManager,
+        memories_summary: Optional[str] = None,
+        stream: bool = False
+    ) -> str | AsyncIterator[str]:
         """
         記事を自然に共有するメッセージを生成
+        
+        memories_summaryを渡せば、記憶の要約を作り直さずにそれを使う
+        stream=Trueなら、生成された本文を順に返す非同期イテレータを返す
         """
-        memories_summary = memory.get_all_memories_summary()
+        if memories_summary is None:
+            memories_summary = memory.get_all_memories_summary(config.EVAL_MEMORY_CHARS)
         
         prompt = f"""
-友達に面白い記事を教えるような感じで、以下の情報を共有するメッセージを作ってください。
-
 ## 共有する記事
 タイトル: {article.title}
 説明: {article.description}
@@ -288,32 +428,28 @@ URL: {article.url}
 
 ## 検索のきっかけ
 「{article.search_query}」に興味があると思って探してみた
-
-## 重要なルール
-- 押し付けがましくなく、自然に
-- 「ねえねえ」「そういえば」「見つけたんだけど」など自然な導入
-- URLは必ず含める
-- 2-3文程度で短く
-- 相手の興味に関連付けて紹介
-- 質問で終わらなくてもOK
-
-## 出力
-メッセージ本文のみ（説明不要）
 """
         
         try:
-            response = await self.client.chat.completions.create(
+            response = await create_completion(
+                self.client, self._openai_sem,
                 model=config.LLM_MODEL,
                 max_completion_tokens=config.MAX_COMPLETION_TOKENS,
-                messages=[{"role": "user", "content": prompt}]
+                messages=[
+                    {"role": "system", "content": SHARE_MESSAGE_SYSTEM},
+                    {"role": "user", "content": prompt}
+                ],
+                stream=stream
             )
+            if stream:
+                return stream_text(response)
             
             content = response.choices[0].message.content
             return content.strip() if content else ""
             
         except Exception as e:
             print(f"Share message generation error: {e}")
-            return ""
+            return single_chunk("") if stream else ""
     
     # =========================================================================
     # メインフロー
@@ -332,21 +468,53 @@ URL: {article.url}
         user_id = memory.user_id
         
         # 1日の共有制限チェック
-        if not self._can_share_today(user_id):
+        if not await self._can_share_today(user_id):
             return None
         
+        # 記憶と会話の要約はこのサイクル中変わらないので、一度だけ作って使い回す
+        memories_summary = memory.get_all_memories_summary(config.EVAL_MEMORY_CHARS)
+        conversation_context = self._evaluation_context(memory)
+        
         # 記事を検索
-        articles = await self.search_for_user(memory)
+        articles = await self.search_for_user(memory, memories_summary=memories_summary)
         
         if not articles:
             return None
         
-        # 各記事を評価
+        # 似た記事を過去に評価済みならそのスコアを使う
+        vectors = None
+        scores: list[Optional[float]] = [None] * len(articles)
+        if config.ENABLE_ARTICLE_SCORE_CACHE:
+            vectors = await self._embed_articles(articles)
+            if vectors is not None:
+                scores = self._lookup_cached_scores(user_id, vectors)
+        
+        # 残りの記事をバッチにまとめて評価（バッチ同士は並行実行）
+        misses = [i for i, score in enumerate(scores) if score is None]
+        batch_size = config.ARTICLE_EVALUATION_BATCH_SIZE
+        batches = [misses[i:i + batch_size] for i in range(0, len(misses), batch_size)]
+        batch_scores = await asyncio.gather(*(
+            self.evaluate_articles_relevance(
+                [articles[i] for i in batch], memory, memories_summary, conversation_context
+            )
+            for batch in batches
+        ))
+        evaluated = [score for batch in batch_scores for score in batch]
+        for i, score in zip(misses, evaluated):
+            scores[i] = score
+        
+        if vectors is not None:
+            # 評価に失敗した記事（スコア0）はキャッシュしない
+            stored = [i for i, score in zip(misses, evaluated) if score > 0]
+            if stored:
+                self._store_scores(
+                    user_id, vectors[stored], [scores[i] for i in stored]
+                )
+        
         best_article = None
         best_score = 0
         
-        for article in articles:
-            score = await self.evaluate_article_relevance(article, memory)
+        for article, score in zip(articles, scores):
             article.relevance_score = score
             
             if score > best_score and score >= config.INFO_SHARE_MOTIVATION_THRESHOLD:
@@ -357,7 +525,7 @@ URL: {article.url}
             return None
         
         # メッセージ生成
-        message = await self.generate_share_message(best_article, memory)
+        message = await self.generate_share_message(best_article, memory, memories_summary)
         
         if message:
             best_article.shared = True
@@ -370,29 +538,217 @@ URL: {article.url}
     # ヘルパー
     # =========================================================================
     
-    def _can_share_today(self, user_id: str) -> bool:
+    def _evaluation_context(self, memory: MemoryManager) -> str:
+        """記事評価に含める最近の会話"""
+        # しばらく話していなければ、直近の会話は記事の評価にほとんど役立たないので省く
+        if memory.get_silence_duration() >= config.EVAL_CONTEXT_MAX_SILENCE:
+            return "（しばらく会話していません）"
+        return memory.get_context_summary(config.EVAL_CONTEXT_CHARS)
+    
+    async def _can_share_today(self, user_id: str) -> bool:
         """今日まだ共有できるかチェック"""
-        now = datetime.now()
+        await self._load_share_state(user_id)
+        today = date.today().toordinal()
         
         # 日付が変わっていたらリセット
-        if user_id in self.last_share_reset:
-            if now.date() > self.last_share_reset[user_id].date():
-                self.daily_shares[user_id] = 0
-                self.last_share_reset[user_id] = now
-        else:
-            self.last_share_reset[user_id] = now
-            self.daily_shares[user_id] = 0
+        day, count = self._share_state.get(user_id, (today, 0))
+        if day != today:
+            count = 0
+            self._share_state[user_id] = (today, 0)
         
-        return self.daily_shares.get(user_id, 0) < config.MAX_DAILY_SHARES
+        return count < config.MAX_DAILY_SHARES
     
     def _increment_daily_shares(self, user_id: str):
         """共有カウントを増やす"""
-        self.daily_shares[user_id] = self.daily_shares.get(user_id, 0) + 1
+        today = date.today().toordinal()
+        day, count = self._share_state.get(user_id, (today, 0))
+        self._share_state[user_id] = (today, count + 1 if day == today else 1)
+        self._save_share_state(user_id)
+    
+    @staticmethod
+    def _url_key(url: str) -> int:
+        """URLを64bitの整数に縮める（文字列のまま保持するよりメモリが小さい）"""
+        return int.from_bytes(hashlib.blake2b(url.encode(), digest_size=8).digest(), "little")
+    
+    @staticmethod
+    def _storage_path(user_id: str) -> str:
+        """共有状態の保存先（記憶と同じユーザーごとのディレクトリ）"""
+        return f"{config.MEMORY_DIRECTORY}/{user_id}"
+    
+    async def _load_share_state(self, user_id: str):
+        """既知URLと本日の共有数をディスクから読み込む（ユーザーごとに初回のみ。読み込みはスレッドで行う）"""
+        if user_id in self.seen_urls:
+            return
+        
+        seen, share_state, log_size, legacy = await asyncio.to_thread(
+            self._read_share_state, self._storage_path(user_id)
+        )
+        # 読み込み中に他のタスクが先に読み込んでいたらそちらを使う
+        if user_id in self.seen_urls:
+            return
+        
+        self.seen_urls[user_id] = seen
+        self._seen_log_size[user_id] = log_size
+        if share_state:
+            self._share_state[user_id] = share_state
+        if legacy:
+            # 以前の形式（share_state.jsonに既知URLを全部書いていた）から移し、共有数だけ書き直す
+            self._compact_seen_urls(user_id)
+            self._save_share_state(user_id)
+    
+    @staticmethod
+    def _read_share_state(
+        storage_path: str
+    ) -> tuple[OrderedDict[int, None], Optional[tuple[int, int]], int, bool]:
+        """既知URL・共有数・追記ログの行数・以前の形式だったかを読み込む（スレッドで実行）"""
+        seen: OrderedDict[int, None] = OrderedDict()
+        share_state = None
+        log_size = 0
+        legacy = False
+        try:
+            state_path = f"{storage_path}/share_state.json"
+            if os.path.exists(state_path):
+                with open(state_path, "rb") as f:
+                    data = loads(f.read())
+                if data.get("share_day"):
+                    share_state = (data["share_day"], data.get("daily_shares", 0))
+                if data.get("seen_urls"):
+                    seen = OrderedDict.fromkeys(data["seen_urls"])
+                    legacy = True
+            
+            # 追記ログを順に再生する（再び見かけたURLは末尾に移す）
+            log_path = f"{storage_path}/seen_urls.log"
+            if os.path.exists(log_path):
+                with open(log_path, encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            key = int(line, 16)
+                        except ValueError:
+                            break  # 書き込み途中で終了した行
+                        seen.pop(key, None)
+                        seen[key] = None
+                        log_size += 1
+        except (OSError, ValueError) as e:
+            print(f"Share state load error: {e}")
+        
+        while len(seen) > config.MAX_SEEN_URLS:
+            seen.popitem(last=False)
+        return seen, share_state, log_size, legacy
+    
+    def _save_share_state(self, user_id: str):
+        """本日の共有数をディスクに保存（書き込みは記憶と同じバックグラウンドスレッドで、アトミックに置き換える）"""
+        storage_path = self._storage_path(user_id)
+        os.makedirs(storage_path, exist_ok=True)
+        
+        day, count = self._share_state.get(user_id, (0, 0))
+        data = dumps({"share_day": day, "daily_shares": count})
+        _submit_save(functools.partial(
+            _replace_file, f"{storage_path}/share_state.json", data.encode()
+        ))
+    
+    def _save_seen_urls(self, user_id: str, keys: list[int]):
+        """新しく見つけた・再び見かけたURLを追記ログに書く（増えすぎたら今の一覧だけに書き直す）"""
+        size = self._seen_log_size.get(user_id, 0) + len(keys)
+        if size > 2 * config.MAX_SEEN_URLS:
+            self._compact_seen_urls(user_id)
+            return
+        
+        storage_path = self._storage_path(user_id)
+        os.makedirs(storage_path, exist_ok=True)
+        _submit_save(functools.partial(
+            _append_text, f"{storage_path}/seen_urls.log", "".join(f"{k:x}\n" for k in keys)
+        ))
+        self._seen_log_size[user_id] = size
+    
+    def _compact_seen_urls(self, user_id: str):
+        """既知URLの追記ログを今の一覧（古い順）だけに書き直す"""
+        storage_path = self._storage_path(user_id)
+        os.makedirs(storage_path, exist_ok=True)
+        seen = self.seen_urls.get(user_id, ())
+        _submit_save(functools.partial(
+            _replace_file,
+            f"{storage_path}/seen_urls.log",
+            "".join(f"{k:x}\n" for k in seen).encode()
+        ))
+        self._seen_log_size[user_id] = len(seen)
+    
+    async def _embed_articles(self, articles: list[Article]) -> Optional[np.ndarray]:
+        """記事のembeddingを1回のAPI呼び出しでまとめて取得（L2正規化済み）"""
+        texts = [
+            f"{a.title} {a.description} {a.search_query}".strip() or a.url
+            for a in articles
+        ]
+        try:
+            async with self._openai_sem:
+                response = await self.client.embeddings.create(
+                    model=config.EMBEDDING_MODEL,
+                    input=texts
+                )
+        except Exception as e:
+            print(f"Article embedding error: {e}")
+            return None
+        
+        vectors = np.array([d.embedding for d in response.data], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+    
+    def _lookup_cached_scores(
+        self, 
+        user_id: str, 
+        vectors: np.ndarray
+    ) -> list[Optional[float]]:
+        """各記事について、コサイン類似度が閾値以上の評価済み記事のスコアを返す"""
+        cached = self._score_cache.get(user_id)
+        if cached is None:
+            return [None] * len(vectors)
+        
+        cached_vectors, cached_scores = cached
+        similarities = np.dot(cached_vectors, vectors.T)  # (キャッシュ数, 記事数)
+        best = similarities.argmax(axis=0)
+        hits = similarities[best, np.arange(len(vectors))] >= config.ARTICLE_SCORE_CACHE_THRESHOLD
+        return [
+            float(cached_scores[j]) if hit else None
+            for j, hit in zip(best, hits)
+        ]
+    
+    def _store_scores(self, user_id: str, vectors: np.ndarray, scores: list[float]):
+        """評価結果をキャッシュに追加（古いものから捨てる）"""
+        new_scores = np.asarray(scores, dtype=np.float32)
+        cached = self._score_cache.get(user_id)
+        if cached is not None:
+            vectors = np.vstack((cached[0], vectors))
+            new_scores = np.concatenate((cached[1], new_scores))
+        limit = config.ARTICLE_SCORE_CACHE_SIZE
+        self._score_cache[user_id] = (vectors[-limit:], new_scores[-limit:])
+    
+    @staticmethod
+    def _request_key(model: str, system: str, prompt: str) -> str:
+        """リクエスト内容からsingle-flight用のキーを作る"""
+        return hashlib.blake2b(
+            "\0".join((model, system, prompt)).encode(), digest_size=16
+        ).hexdigest()
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        """HTTPセッションを取得（なければkeep-alive付きで作成）"""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=32, ttl_dns_cache=300, keepalive_timeout=30
+                )
+            )
+            self._owns_session = True
+        return self.session
+    
+    async def close(self):
+        """自前で作ったHTTPセッションを閉じる"""
+        if self._owns_session and self.session and not self.session.closed:
+            await self.session.close()
     
     def get_share_stats(self, user_id: str) -> dict:
         """共有統計を取得"""
+        day, count = self._share_state.get(user_id, (0, 0))
         return {
-            "today_shares": self.daily_shares.get(user_id, 0),
+            "today_shares": count if day == date.today().toordinal() else 0,
             "max_daily": config.MAX_DAILY_SHARES,
-            "seen_articles": len(self.seen_urls.get(user_id, set()))
+            "seen_articles": len(self.seen_urls.get(user_id, ()))
         }
@@ -3,16 +3,25 @@ Proactive AI Friend - Inner Thoughts Engine
 思考生成、動機づけ評価、記憶抽出のコアエンジン
 """
 
+import asyncio
 import json
 import re
-from typing import Optional
+import traceback
+from typing import AsyncIterator, Optional
 from openai import AsyncOpenAI
 
 import config
 import prompts
+from json_utils import loads
+from llm_utils import FAST_MODEL_OPTIONS, create_completion, single_chunk, stream_text
 from memory import MemoryManager, Thought
 
 
+# コードブロック内のJSON
+_JSON_BLOCK_RE = re.compile(r'```(?:json)?\s*([\s\S]*?)\s*```')
+_JSON_DECODER = json.JSONDecoder()
+
+
 class InnerThoughtsEngine:
     """
     Inner Thoughtsフレームワークの実装
@@ -25,8 +34,11 @@ class InnerThoughtsEngine:
     5. Participation - 発言の決定と実行
     """
     
-    def __init__(self):
-        self.client = AsyncOpenAI(api_key=config.OPENAI_API_KEY)
+    def __init__(self, client: Optional[AsyncOpenAI] = None):
+        self.client = client or AsyncOpenAI(api_key=config.OPENAI_API_KEY)
+        
+        # ユーザーが増えてもOpenAIに一斉にリクエストしない（429とリトライで逆に遅くなる）
+        self._openai_sem = asyncio.Semaphore(config.OPENAI_CONCURRENCY)
     
     # =========================================================================
     # ステージ1: Trigger（トリガー検出）
@@ -45,7 +57,7 @@ class InnerThoughtsEngine:
             return True, f"silence_timeout ({int(silence)}s)"
         
         # 定期的な思考生成（会話中）
-        if memory.last_user_message_time:
+        if memory.last_user_message_time is not None:
             if silence > config.THOUGHT_GENERATION_INTERVAL:
                 return True, f"periodic ({int(silence)}s since last message)"
         
@@ -64,8 +76,16 @@ class InnerThoughtsEngine:
         内なる思考を生成
         """
         # コンテキスト準備
-        conversation_context = memory.get_context_summary()
-        user_memories = memory.get_all_memories_summary()
+        conversation_context = memory.get_context_summary(config.EVAL_CONTEXT_CHARS)
+        
+        # 関連記憶の取得（今の会話に関係しそうな記憶を渡す。無ければ重要度の高い順の要約）
+        relevant = await memory.get_relevant_memories(conversation_context)
+        if relevant:
+            user_memories = "\n".join(
+                f"- {mem.key}: {mem.content}" for mem in relevant
+            )[:config.EVAL_MEMORY_CHARS]
+        else:
+            user_memories = memory.get_all_memories_summary(config.EVAL_MEMORY_CHARS)
         
         # 保留中の思考
         pending = memory.get_pending_thoughts()
@@ -82,10 +102,14 @@ class InnerThoughtsEngine:
         )
         
         try:
-            response = await self.client.chat.completions.create(
+            response = await create_completion(
+                self.client, self._openai_sem,
                 model=config.LLM_MODEL,
                 max_completion_tokens=config.MAX_COMPLETION_TOKENS,
-                messages=[{"role": "user", "content": prompt}]
+                messages=[
+                    {"role": "system", "content": prompts.THOUGHT_GENERATION_SYSTEM},
+                    {"role": "user", "content": prompt}
+                ]
             )
             
             # JSON抽出
@@ -123,17 +147,23 @@ class InnerThoughtsEngine:
         """
         prompt = prompts.format_motivation_evaluation_prompt(
             thought=thought_content,
-            conversation_context=memory.get_context_summary(),
+            conversation_context=memory.get_context_summary(config.EVAL_CONTEXT_CHARS),
             silence_duration=memory.get_silence_duration(),
             consecutive_ai_messages=memory.consecutive_ai_messages,
             total_turns=len(memory.short_term)
         )
         
         try:
-            response = await self.client.chat.completions.create(
-                model=config.LLM_MODEL,
-                max_completion_tokens=config.MAX_COMPLETION_TOKENS,
-                messages=[{"role": "user", "content": prompt}]
+            response = await create_completion(
+                self.client, self._openai_sem,
+                model=config.LLM_MODEL_FAST,
+                max_completion_tokens=config.SCORE_MAX_TOKENS,
+                response_format={"type": "json_object"},
+                **FAST_MODEL_OPTIONS,
+                messages=[
+                    {"role": "system", "content": prompts.MOTIVATION_EVALUATION_SYSTEM},
+                    {"role": "user", "content": prompt}
+                ]
             )
             
             # デバッグ: レスポンス全体を確認
@@ -163,66 +193,95 @@ class InnerThoughtsEngine:
         thought: Thought,
         potential_response: str,
         memory: MemoryManager,
-        trigger_reason: str
-    ) -> str:
+        trigger_reason: str,
+        stream: bool = False
+    ) -> str | AsyncIterator[str]:
         """
         自発的な発言を生成
+        
+        stream=Trueなら、生成された本文を順に返す非同期イテレータを返す
         """
         prompt = prompts.format_proactive_response_prompt(
             thought=potential_response,
-            conversation_context=memory.get_context_summary(),
-            user_memories=memory.get_all_memories_summary(),
+            conversation_context=memory.get_context_summary(config.EVAL_CONTEXT_CHARS),
+            user_memories=memory.get_all_memories_summary(config.EVAL_MEMORY_CHARS),
             silence_duration=memory.get_silence_duration(),
             trigger_reason=trigger_reason
         )
         
         try:
-            response = await self.client.chat.completions.create(
+            response = await create_completion(
+                self.client, self._openai_sem,
                 model=config.LLM_MODEL,
                 max_completion_tokens=config.MAX_COMPLETION_TOKENS,
-                messages=[{"role": "user", "content": prompt}]
+                messages=[
+                    {"role": "system", "content": prompts.PROACTIVE_RESPONSE_SYSTEM},
+                    {"role": "user", "content": prompt}
+                ],
+                stream=stream
             )
+            if stream:
+                return stream_text(response)
             
             content = response.choices[0].message.content
             return content.strip() if content else ""
             
         except Exception as e:
             print(f"Proactive response error: {e}")
-            return ""
+            return single_chunk("") if stream else ""
     
-    async def generate_silence_break(self, memory: MemoryManager) -> str:
+    async def generate_silence_break(
+        self, 
+        memory: MemoryManager, 
+        stream: bool = False
+    ) -> str | AsyncIterator[str]:
         """
         沈黙を破る発言を生成
+        
+        stream=Trueなら、生成された本文を順に返す非同期イテレータを返す
         """
-        last_conv = memory.get_context_summary()
+        last_conv = memory.get_context_summary(config.EVAL_CONTEXT_CHARS)
         
         prompt = prompts.format_silence_break_prompt(
-            user_memories=memory.get_all_memories_summary(),
+            user_memories=memory.get_all_memories_summary(config.EVAL_MEMORY_CHARS),
             last_conversation=last_conv,
             silence_duration=memory.get_silence_duration()
         )
         
         try:
-            response = await self.client.chat.completions.create(
+            response = await create_completion(
+                self.client, self._openai_sem,
                 model=config.LLM_MODEL,
                 max_completion_tokens=config.MAX_COMPLETION_TOKENS,
-                messages=[{"role": "user", "content": prompt}]
+                messages=[
+                    {"role": "system", "content": prompts.SILENCE_BREAK_SYSTEM},
+                    {"role": "user", "content": prompt}
+                ],
+                stream=stream
             )
+            if stream:
+                return stream_text(response)
             
             content = response.choices[0].message.content
             return content.strip() if content else ""
             
         except Exception as e:
             print(f"Silence break error: {e}")
-            return ""
+            return single_chunk("") if stream else ""
     
     # =========================================================================
     # 反応的応答（従来型）
     # =========================================================================
     
-    async def generate_reactive_response(self, memory: MemoryManager) -> str:
+    async def generate_reactive_response(
+        self, 
+        memory: MemoryManager, 
+        stream: bool = False
+    ) -> str | AsyncIterator[str]:
         """
         ユーザーのメッセージに対する通常の応答
+        
+        stream=Trueなら、生成された本文を順に返す非同期イテレータを返す
         """
         system_prompt = prompts.format_system_prompt(
             user_memories=memory.get_all_memories_summary()
@@ -233,11 +292,15 @@ class InnerThoughtsEngine:
         try:
             # OpenAI形式: systemはmessages内の最初の要素として渡す
             openai_messages = [{"role": "system", "content": system_prompt}] + messages
-            response = await self.client.chat.completions.create(
+            response = await create_completion(
+                self.client, self._openai_sem,
                 model=config.LLM_MODEL,
                 max_completion_tokens=config.MAX_COMPLETION_TOKENS,
-                messages=openai_messages
+                messages=openai_messages,
+                stream=stream
             )
+            if stream:
+                return stream_text(response)
             
             content = response.choices[0].message.content
             # デバッグ: contentが空の場合、response全体を確認
@@ -246,10 +309,10 @@ class InnerThoughtsEngine:
             return content.strip() if content else "ごめん、ちょっと調子悪いみたい..."
             
         except Exception as e:
-            import traceback
             print(f"Reactive response error: {e}")
             traceback.print_exc()
-            return "ごめんね、ちょっと調子悪いみたい..."
+            fallback = "ごめんね、ちょっと調子悪いみたい..."
+            return single_chunk(fallback) if stream else fallback
     
     # =========================================================================
     # 記憶抽出
@@ -272,10 +335,14 @@ class InnerThoughtsEngine:
         )
         
         try:
-            response = await self.client.chat.completions.create(
+            response = await create_completion(
+                self.client, self._openai_sem,
                 model=config.LLM_MODEL,
                 max_completion_tokens=config.MAX_COMPLETION_TOKENS,
-                messages=[{"role": "user", "content": prompt}]
+                messages=[
+                    {"role": "system", "content": prompts.MEMORY_EXTRACTION_SYSTEM},
+                    {"role": "user", "content": prompt}
+                ]
             )
             
             raw_content = response.choices[0].message.content or ""
@@ -355,38 +422,19 @@ class InnerThoughtsEngine:
     def _extract_json(self, text: str) -> Optional[dict | list]:
         """テキストからJSONを抽出"""
         # コードブロック内のJSON
-        json_match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', text)
+        json_match = _JSON_BLOCK_RE.search(text)
         if json_match:
             try:
-                return json.loads(json_match.group(1))
+                return loads(json_match.group(1))
             except json.JSONDecodeError:
                 pass
         
-        # 直接JSON
-        try:
-            # { または [ で始まる部分を探す
-            start_idx = min(
-                text.find('{') if text.find('{') != -1 else len(text),
-                text.find('[') if text.find('[') != -1 else len(text)
-            )
-            if start_idx < len(text):
-                # 対応する閉じ括弧を探す
-                bracket_count = 0
-                end_idx = start_idx
-                open_bracket = text[start_idx]
-                close_bracket = '}' if open_bracket == '{' else ']'
-                
-                for i, char in enumerate(text[start_idx:], start_idx):
-                    if char == open_bracket:
-                        bracket_count += 1
-                    elif char == close_bracket:
-                        bracket_count -= 1
-                        if bracket_count == 0:
-                            end_idx = i + 1
-                            break
-                
-                return json.loads(text[start_idx:end_idx])
-        except (json.JSONDecodeError, ValueError):
-            pass
+        # 直接JSON（最初の { または [ からC実装のデコーダで読み取る）
+        starts = [i for i in (text.find('{'), text.find('[')) if i != -1]
+        if starts:
+            try:
+                return _JSON_DECODER.raw_decode(text, min(starts))[0]
+            except json.JSONDecodeError:
+                pass
         
         return None
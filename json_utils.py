@@ -0,0 +1,23 @@
+"""
+Proactive AI Friend - JSON Utilities
+JSONの読み書き（orjsonがあればC実装を使う）
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:  # 任意依存。無ければ標準のjsonを使う
+    orjson = None
+
+
+def dumps(obj) -> str:
+    """JSON文字列に変換（日本語はエスケープしない）"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def loads(data: str | bytes):
+    """JSONを読み込む（不正なJSONならValueErrorのサブクラスのjson.JSONDecodeError）"""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
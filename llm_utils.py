@@ -0,0 +1,52 @@
+"""
+Proactive AI Friend - LLM Utilities
+OpenAI API呼び出しの共通処理
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Hashable
+
+from openai import AsyncOpenAI
+
+import config
+
+
+# 判定用の軽量モデルに渡す追加パラメータ
+FAST_MODEL_OPTIONS = (
+    {"reasoning_effort": config.LLM_MODEL_FAST_REASONING_EFFORT}
+    if config.LLM_MODEL_FAST_REASONING_EFFORT else {}
+)
+
+
+async def stream_text(response) -> AsyncIterator[str]:
+    """ストリーミング応答から本文の差分を順に取り出す"""
+    async for chunk in response:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+async def single_chunk(text: str) -> AsyncIterator[str]:
+    """文字列を1チャンクだけのストリームにする（エラー時のフォールバック用）"""
+    if text:
+        yield text
+
+
+async def create_completion(client: AsyncOpenAI, semaphore: asyncio.Semaphore, **kwargs):
+    """同時リクエスト数を制限してChat Completions APIを呼ぶ"""
+    async with semaphore:
+        return await client.chat.completions.create(**kwargs)
+
+
+async def dedup_call(
+    inflight: dict[Hashable, asyncio.Future],
+    key: Hashable,
+    coro_factory: Callable[[], Awaitable[Any]]
+):
+    """同じキーのリクエストが実行中ならその結果を共有し、なければ実行する（inflightは呼び出し側が持つ）"""
+    future = inflight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(coro_factory())
+        inflight[key] = future
+        future.add_done_callback(lambda _: inflight.pop(key, None))
+    # 待っている誰かがキャンセルされても、共有中のリクエストは止めない
+    return await asyncio.shield(future)
@@ -3,17 +3,113 @@ Proactive AI Friend - Memory System
 短期記憶、長期記憶、思考リザーバーの管理
 """
 
-import json
+import asyncio
+import atexit
+import functools
+import heapq
+import io
+import logging
 import os
+import queue
+import threading
+import time
 from datetime import datetime
-from typing import Optional
-from dataclasses import dataclass, asdict
+from typing import Callable, Optional
+from dataclasses import dataclass, asdict, field, fields
 from collections import deque
+from itertools import islice
 
 import config
+from json_utils import dumps, loads
 
+try:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # 任意依存。無ければ関連記憶はキーワードで検索する
+    np = None
+    SentenceTransformer = None
 
-@dataclass
+logger = logging.getLogger(__name__)
+
+
+# 埋め込みモデル（全ユーザーで共有し、初めて必要になったときに読み込む）
+# 読み込みと計算は重いので、イベントループではなくスレッドから呼ぶ
+_embed_model = None
+_embed_model_lock = threading.Lock()
+
+
+def _embeddings_enabled() -> bool:
+    """embeddingで関連記憶を検索するか（モデルは読み込まない）"""
+    return SentenceTransformer is not None and config.ENABLE_EMBEDDING_RETRIEVAL
+
+
+def _get_embed_model():
+    """記憶検索用の埋め込みモデルを取得。使えない場合はNone"""
+    global _embed_model
+    if _embed_model is None and _embeddings_enabled():
+        with _embed_model_lock:
+            if _embed_model is None:
+                _embed_model = SentenceTransformer(config.MEMORY_EMBEDDING_MODEL)
+    return _embed_model
+
+
+# ディスク書き込み用のスレッド（全ユーザー共通）
+# シリアライズは呼び出し側で済ませ、ファイルへの書き込みだけを順番に実行する
+_save_queue: "queue.Queue[Callable[[], None]]" = queue.Queue()
+_save_thread: Optional[threading.Thread] = None
+_save_thread_lock = threading.Lock()  # 記憶の読み込みはスレッドでも行うので、書き込みスレッドを二重に起動しない
+
+
+def _save_worker():
+    while True:
+        job = _save_queue.get()
+        try:
+            job()
+        except Exception:
+            logger.exception("Memory save error")
+        finally:
+            _save_queue.task_done()
+
+
+def _submit_save(job: Callable[[], None]):
+    """書き込みをバックグラウンドスレッドに任せる（終了時には書き終わるまで待つ）"""
+    global _save_thread
+    if _save_thread is None:
+        with _save_thread_lock:
+            if _save_thread is None:
+                _save_thread = threading.Thread(target=_save_worker, name="memory-writer", daemon=True)
+                _save_thread.start()
+                atexit.register(_save_queue.join)
+    _save_queue.put(job)
+
+
+def _append_text(path: str, text: str):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(text)
+
+
+def _replace_file(path: str, data: bytes):
+    """一時ファイルに書いてから置き換える（書き込み途中で落ちても元のファイルが残る）"""
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _write_snapshot(storage_path: str, snapshot: str):
+    """長期記憶のスナップショットを書き、それまでの追記ログを空にする"""
+    _replace_file(f"{storage_path}/long_term.json", snapshot.encode("utf-8"))
+    # 置き換え後、空にする前に落ちても、追記ログの再生は同じ状態になるだけなので問題ない
+    open(f"{storage_path}/long_term.jsonl", "w").close()
+
+
+def _write_embeddings(path: str, texts: "np.ndarray", vectors: "np.ndarray"):
+    buffer = io.BytesIO()
+    np.savez(buffer, texts=texts, vectors=vectors)
+    _replace_file(path, buffer.getvalue())
+
+
+@dataclass(slots=True)
 class Message:
     """会話メッセージ"""
     role: str  # "user" or "assistant"
@@ -25,7 +121,7 @@ class Message:
         return asdict(self)
 
 
-@dataclass
+@dataclass(slots=True)
 class Thought:
     """AIの内なる思考"""
     content: str
@@ -39,7 +135,7 @@ class Thought:
         return asdict(self)
 
 
-@dataclass
+@dataclass(slots=True)
 class LongTermMemory:
     """長期記憶エントリ"""
     user_id: str
@@ -50,8 +146,32 @@ class LongTermMemory:
     last_accessed: str
     access_count: int = 1
     
+    # キーワード検索用の派生値（保存しない）
+    _key_lower: str = field(init=False, repr=False, compare=False)
+    _content_tokens: frozenset[str] = field(init=False, repr=False, compare=False)
+    _base_score: float = field(init=False, repr=False, compare=False)
+    
+    # 保存用のJSON文字列（変更されるまで使い回す。Noneなら未生成）
+    _json: Optional[str] = field(init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        self.refresh_derived()
+    
+    def refresh_derived(self):
+        """派生値を計算し直す（フィールドを変えたら呼ぶ）"""
+        self._key_lower = self.key.lower()
+        self._content_tokens = frozenset(self.content.lower().split())
+        self._base_score = self.importance * 0.5 + min(self.access_count * 0.1, 1)
+        self._json = None
+    
     def to_dict(self):
-        return asdict(self)
+        return {f.name: getattr(self, f.name) for f in fields(self) if f.init}
+    
+    def to_json(self) -> str:
+        """保存用のJSON文字列を取得（変更がなければ前回の結果を返す）"""
+        if self._json is None:
+            self._json = dumps(self.to_dict())
+        return self._json
 
 
 class MemoryManager:
@@ -73,20 +193,41 @@ class MemoryManager:
         # 長期記憶
         self.long_term: list[LongTermMemory] = []
         
+        # 長期記憶のembedding（L2正規化済み、long_termと同じ順。未計算ならNone）
+        self._lt_embeddings: Optional["np.ndarray"] = None
+        
+        # キーワード検索用の索引（長期記憶が変わったら捨てて、次の検索時に作り直す）
+        self._keyword_index: Optional[tuple[dict[str, list[int]], dict[str, list[int]], list[int]]] = None
+        
         # 思考リザーバー（保留中の思考）
         self.thought_reservoir: deque[Thought] = deque(
             maxlen=config.THOUGHT_RESERVOIR_SIZE
         )
         
-        # 最後の発言時刻
-        self.last_user_message_time: Optional[datetime] = None
-        self.last_ai_message_time: Optional[datetime] = None
+        # 未発言の思考をスコアの高い順に取り出すためのヒープ (-スコア, 追加順, 思考)
+        # 発言済み・リザーバーから押し出された思考は取り出すときに捨てる
+        self._pending_heap: list[tuple[float, int, Thought]] = []
+        self._thought_seq = 0
+        
+        # 最後の発言時刻（経過時間の計算にだけ使うのでtime.monotonic()の値）
+        self.last_user_message_time: Optional[float] = None
+        self.last_ai_message_time: Optional[float] = None
         
         # 連続AI発言カウント
         self.consecutive_ai_messages = 0
         
+        # 前回の記憶抽出からのメッセージ数
+        self.turns_since_extraction = 0
+        
+        # 会話要約用の直近メッセージの行と、それをつないだ要約（発言があるまで使い回す）
+        self._recent_summary_parts: deque[str] = deque(maxlen=5)
+        self._context_summary: Optional[str] = None
+        
         # 永続化用のパス
-        self.storage_path = f"memory_store/{user_id}"
+        self.storage_path = f"{config.MEMORY_DIRECTORY}/{user_id}"
+        
+        # 追記ログ（long_term.jsonl）の行数。増えすぎたらスナップショットにまとめる
+        self._wal_size = 0
         
         # 既存データの読み込み
         self._load_from_disk()
@@ -104,56 +245,79 @@ class MemoryManager:
             user_id=self.user_id
         )
         self.short_term.append(message)
+        self.turns_since_extraction += 1
+        
+        role_name = "ユーザー" if role == "user" else config.AI_NAME
+        self._recent_summary_parts.append(f"{role_name}: {content[:100]}...")
+        self._context_summary = None
         
         # 発言時刻の更新
         if role == "user":
-            self.last_user_message_time = datetime.now()
+            self.last_user_message_time = time.monotonic()
             self.consecutive_ai_messages = 0
         else:
-            self.last_ai_message_time = datetime.now()
+            self.last_ai_message_time = time.monotonic()
             self.consecutive_ai_messages += 1
         
         return message
     
     def get_conversation_history(self, n: Optional[int] = None) -> list[dict]:
         """会話履歴を取得"""
-        messages = list(self.short_term)
+        messages = self.short_term
         if n:
-            messages = messages[-n:]
+            messages = islice(messages, max(len(messages) - n, 0), None)
         
         return [
             {"role": m.role, "content": m.content}
             for m in messages
         ]
     
-    def get_context_summary(self) -> str:
-        """会話の要約を取得（思考生成用）"""
+    def get_context_summary(self, max_chars: Optional[int] = None) -> str:
+        """会話の要約を取得（思考生成用）。max_charsを指定すると新しい側を残して切り詰める"""
         if not self.short_term:
             return "まだ会話が始まっていません。"
         
-        recent = list(self.short_term)[-5:]
-        summary_parts = []
+        # 直近5件の行はadd_messageで作ってあるので、つなぐだけ
+        if self._context_summary is None:
+            self._context_summary = "\n".join(self._recent_summary_parts)
         
-        for msg in recent:
-            role_name = "ユーザー" if msg.role == "user" else config.AI_NAME
-            summary_parts.append(f"{role_name}: {msg.content[:100]}...")
-        
-        return "\n".join(summary_parts)
+        summary = self._context_summary
+        return summary if max_chars is None else summary[-max_chars:]
     
     # =========================================================================
     # 長期記憶操作
     # =========================================================================
     
-    def add_long_term_memory(self, key: str, content: str, importance: float = 3.0):
-        """長期記憶に追加"""
+    async def add_long_term_memory(self, key: str, content: str, importance: float = 3.0):
+        """長期記憶に追加（embeddingの計算はイベントループの外で行う）"""
+        vector = None
+        if self._lt_embeddings is not None:
+            vector = (await self._encode_async([f"{key}: {content}"]))[0]  # _memory_textと同じ形
+        return self._put_long_term_memory(key, content, importance, vector)
+    
+    def _put_long_term_memory(
+        self, key: str, content: str, importance: float, vector: Optional["np.ndarray"]
+    ) -> LongTermMemory:
+        """長期記憶に追加（vectorは計算済みのembedding。無ければembedding行列は作り直しにする）"""
+        now = datetime.now().isoformat()
+        self._keyword_index = None
+        
+        # 計算中に行列が作られていたら、この記憶の分が無いので次の検索時に作り直す
+        if vector is None:
+            self._lt_embeddings = None
+        
         # 同じキーの既存記憶を更新
-        for mem in self.long_term:
+        for i, mem in enumerate(self.long_term):
             if mem.key == key and mem.user_id == self.user_id:
                 mem.content = content
                 mem.importance = importance
-                mem.last_accessed = datetime.now().isoformat()
+                mem.last_accessed = now
                 mem.access_count += 1
-                self._save_to_disk()
+                mem.refresh_derived()
+                if self._lt_embeddings is not None:
+                    self._lt_embeddings[i] = vector
+                self._append_to_log([self._put_record(mem)])
+                self._save_embeddings()
                 return mem
         
         # 新規追加
@@ -162,51 +326,82 @@ class MemoryManager:
             key=key,
             content=content,
             importance=importance,
-            created_at=datetime.now().isoformat(),
-            last_accessed=datetime.now().isoformat()
+            created_at=now,
+            last_accessed=now
         )
         self.long_term.append(memory)
+        if self._lt_embeddings is not None:
+            self._lt_embeddings = np.vstack((self._lt_embeddings, vector[None]))
         
-        # サイズ制限
-        if len(self.long_term) > config.LONG_TERM_MEMORY_SIZE:
-            # 重要度とアクセス頻度が低いものを削除
-            self.long_term.sort(
-                key=lambda x: x.importance * x.access_count,
-                reverse=True
+        records = [self._put_record(memory)]
+        
+        # サイズ制限（追加は1件ずつなので、通常は1件削除するだけ）
+        while len(self.long_term) > config.LONG_TERM_MEMORY_SIZE:
+            # 重要度とアクセス頻度が最も低いものを削除（同点なら後から入ったもの）
+            victim = min(
+                reversed(range(len(self.long_term))),
+                key=lambda i: self.long_term[i].importance * self.long_term[i].access_count
             )
-            self.long_term = self.long_term[:config.LONG_TERM_MEMORY_SIZE]
+            records.append(self._del_record(self.long_term.pop(victim).key))
+            if self._lt_embeddings is not None:
+                self._lt_embeddings = np.delete(self._lt_embeddings, victim, axis=0)
         
-        self._save_to_disk()
+        self._append_to_log(records)
+        self._save_embeddings()
         return memory
     
-    def get_relevant_memories(self, query: str, top_k: int = 5) -> list[LongTermMemory]:
-        """関連する長期記憶を取得（簡易的なキーワードマッチング）"""
-        # TODO: 将来的にはembeddingベースの検索に置き換え
+    async def get_relevant_memories(self, query: str, top_k: int = 5) -> list[LongTermMemory]:
+        """関連する長期記憶を取得（embeddingのコサイン類似度、使えなければキーワードマッチング）"""
+        if self.long_term and _embeddings_enabled():
+            memories = list(self.long_term)
+            embeddings = self._lt_embeddings
+            if embeddings is None or len(embeddings) != len(memories):
+                # 記憶とクエリをまとめて計算し、計算中に記憶が変わっていなければ保存して使い回す
+                texts = [self._memory_text(m) for m in memories]
+                vectors = await self._encode_async(texts + [query])
+                embeddings, query_vector = vectors[:-1], vectors[-1]
+                if [self._memory_text(m) for m in self.long_term] == texts:
+                    self._lt_embeddings = embeddings
+                    self._save_embeddings()
+            else:
+                query_vector = (await self._encode_async([query]))[0]
+            
+            similarities = embeddings @ query_vector
+            top = np.argsort(-similarities)[:top_k]
+            return [
+                memories[i] for i in top
+                if similarities[i] >= config.MEMORY_RELEVANCE_THRESHOLD
+            ]
         
-        scored_memories = []
         query_lower = query.lower()
+        word_index, key_index, by_base_score = self._get_keyword_index()
         
-        for mem in self.long_term:
-            score = 0
-            # キーワードマッチング
-            if mem.key.lower() in query_lower:
-                score += 3
-            if any(word in query_lower for word in mem.content.lower().split()):
-                score += 1
-            # 重要度とアクセス頻度も考慮
-            score += mem.importance * 0.5
-            score += min(mem.access_count * 0.1, 1)
-            
-            if score > 0:
-                scored_memories.append((score, mem))
+        # キーワードマッチング（記憶ごとではなく、異なる単語・キーごとに1回だけ調べる）
+        # 日本語は空白で区切られないので、完全一致ではなく部分一致で見る
+        bonus: dict[int, float] = {}
+        for key, ids in key_index.items():
+            if key in query_lower:
+                for i in ids:
+                    bonus[i] = bonus.get(i, 0) + 3
+        matched: set[int] = set()
+        for word, ids in word_index.items():
+            if word in query_lower:
+                matched.update(ids)
+        for i in matched:
+            bonus[i] = bonus.get(i, 0) + 1
+        
+        # 候補はマッチした記憶と、マッチしなかった中で基本スコア（重要度とアクセス頻度）の上位top_k件
+        candidates = [(self.long_term[i]._base_score + b, i) for i, b in bonus.items()]
+        unmatched = (i for i in by_base_score if i not in bonus)
+        candidates.extend((self.long_term[i]._base_score, i) for i in islice(unmatched, top_k))
         
-        # スコア順でソート
-        scored_memories.sort(key=lambda x: x[0], reverse=True)
+        # スコア上位top_k件だけ取り出す（同点なら古い記憶を優先）
+        top = heapq.nlargest(top_k, candidates, key=lambda x: (x[0], -x[1]))
         
-        return [mem for _, mem in scored_memories[:top_k]]
+        return [self.long_term[i] for score, i in top if score > 0]
     
-    def get_all_memories_summary(self) -> str:
-        """すべての長期記憶の要約"""
+    def get_all_memories_summary(self, max_chars: Optional[int] = None) -> str:
+        """すべての長期記憶の要約。max_charsを指定すると重要度の高い順に収まる分だけ返す"""
         if not self.long_term:
             return "まだユーザーについての情報がありません。"
         
@@ -214,7 +409,46 @@ class MemoryManager:
         for mem in sorted(self.long_term, key=lambda x: x.importance, reverse=True):
             summaries.append(f"- {mem.key}: {mem.content}")
         
-        return "\n".join(summaries[:10])
+        summary = "\n".join(summaries[:10])
+        if max_chars is None or len(summary) <= max_chars:
+            return summary
+        
+        # 項目の途中で切れないように、最後の改行までで切る
+        cut = summary.rfind("\n", 0, max_chars + 1)
+        return summary[:cut] if cut > 0 else summary[:max_chars]
+    
+    def _get_keyword_index(self) -> tuple[dict[str, list[int]], dict[str, list[int]], list[int]]:
+        """キーワード検索用の索引を取得（単語→位置、キー→位置、基本スコアの高い順の位置）"""
+        if self._keyword_index is None:
+            word_index: dict[str, list[int]] = {}
+            key_index: dict[str, list[int]] = {}
+            for i, mem in enumerate(self.long_term):
+                for word in mem._content_tokens:
+                    word_index.setdefault(word, []).append(i)
+                key_index.setdefault(mem._key_lower, []).append(i)
+            by_base_score = sorted(
+                range(len(self.long_term)), key=lambda i: -self.long_term[i]._base_score
+            )
+            self._keyword_index = (word_index, key_index, by_base_score)
+        return self._keyword_index
+    
+    @staticmethod
+    def _memory_text(mem: LongTermMemory) -> str:
+        """embeddingを計算する記憶のテキスト"""
+        return f"{mem.key}: {mem.content}"
+    
+    @staticmethod
+    def _encode(texts: list[str]) -> "np.ndarray":
+        """テキストをL2正規化済みのfloat32ベクトルに変換"""
+        return _get_embed_model().encode(
+            texts, batch_size=64, normalize_embeddings=True,
+            convert_to_numpy=True, show_progress_bar=False
+        ).astype(np.float32)
+    
+    @classmethod
+    async def _encode_async(cls, texts: list[str]) -> "np.ndarray":
+        """_encodeをスレッドで実行（CPUを使う計算でイベントループを止めない）"""
+        return await asyncio.to_thread(cls._encode, texts)
     
     # =========================================================================
     # 思考リザーバー操作
@@ -231,6 +465,12 @@ class MemoryManager:
             triggered_by=triggered_by
         )
         self.thought_reservoir.append(thought)
+        heapq.heappush(self._pending_heap, (-motivation_score, self._thought_seq, thought))
+        self._thought_seq += 1
+        
+        # 取り出されないまま捨てるべき要素が溜まったら、リザーバーの中身から作り直す
+        if len(self._pending_heap) > config.THOUGHT_RESERVOIR_SIZE * 2:
+            self._rebuild_pending_heap()
         return thought
     
     def get_pending_thoughts(self, min_score: float = 0) -> list[Thought]:
@@ -246,10 +486,24 @@ class MemoryManager:
     
     def get_highest_motivation_thought(self) -> Optional[Thought]:
         """最も動機づけスコアが高い未発言の思考を取得"""
-        pending = self.get_pending_thoughts()
-        if not pending:
-            return None
-        return max(pending, key=lambda t: t.motivation_score)
+        heap = self._pending_heap
+        oldest = self._thought_seq - len(self.thought_reservoir)
+        while heap:
+            _, seq, thought = heap[0]
+            if seq >= oldest and not thought.expressed:
+                return thought
+            heapq.heappop(heap)
+        return None
+    
+    def _rebuild_pending_heap(self):
+        """リザーバーにある未発言の思考だけでヒープを作り直す"""
+        oldest = self._thought_seq - len(self.thought_reservoir)
+        self._pending_heap = [
+            (-t.motivation_score, oldest + i, t)
+            for i, t in enumerate(self.thought_reservoir)
+            if not t.expressed
+        ]
+        heapq.heapify(self._pending_heap)
     
     # =========================================================================
     # 状態チェック
@@ -257,9 +511,9 @@ class MemoryManager:
     
     def get_silence_duration(self) -> float:
         """ユーザーの沈黙時間（秒）"""
-        if not self.last_user_message_time:
+        if self.last_user_message_time is None:
             return 0
-        return (datetime.now() - self.last_user_message_time).total_seconds()
+        return time.monotonic() - self.last_user_message_time
     
     def can_intervene(self) -> bool:
         """AIが自発的に発言できるかチェック"""
@@ -268,8 +522,8 @@ class MemoryManager:
             return False
         
         # 最小間隔チェック
-        if self.last_ai_message_time:
-            elapsed = (datetime.now() - self.last_ai_message_time).total_seconds()
+        if self.last_ai_message_time is not None:
+            elapsed = time.monotonic() - self.last_ai_message_time
             if elapsed < config.MIN_INTERVENTION_INTERVAL:
                 return False
         
@@ -279,20 +533,90 @@ class MemoryManager:
     # 永続化
     # =========================================================================
     
+    @staticmethod
+    def _put_record(mem: LongTermMemory) -> str:
+        """追記ログの追加・更新レコード（記憶のJSONはスナップショットでも使い回す）"""
+        return f'{{"op": "put", "memory": {mem.to_json()}}}'
+    
+    @staticmethod
+    def _del_record(key: str) -> str:
+        """追記ログの削除レコード"""
+        return dumps({"op": "del", "key": key})
+    
+    def _append_to_log(self, records: list[str]):
+        """長期記憶の変更を追記ログに書く（一定行数を超えたらスナップショットにまとめる）"""
+        self._wal_size += len(records)
+        if self._wal_size > config.LONG_TERM_MEMORY_SIZE * 2:
+            self._save_to_disk()
+            return
+        
+        os.makedirs(self.storage_path, exist_ok=True)
+        text = "".join(r + "\n" for r in records)
+        _submit_save(functools.partial(
+            _append_text, f"{self.storage_path}/long_term.jsonl", text
+        ))
+    
     def _save_to_disk(self):
-        """記憶をディスクに保存"""
+        """記憶のスナップショットをディスクに保存（書き込みはバックグラウンド）"""
         os.makedirs(self.storage_path, exist_ok=True)
         
-        # 長期記憶の保存
-        long_term_data = [m.to_dict() for m in self.long_term]
-        with open(f"{self.storage_path}/long_term.json", "w", encoding="utf-8") as f:
-            json.dump(long_term_data, f, ensure_ascii=False, indent=2)
+        # 長期記憶の保存（変更のない記憶は前回のJSONをそのまま使う）
+        snapshot = "[\n" + ",\n".join(m.to_json() for m in self.long_term) + "\n]"
+        _submit_save(functools.partial(_write_snapshot, self.storage_path, snapshot))
+        self._wal_size = 0
+    
+    def _save_embeddings(self):
+        """embeddingを長期記憶の隣に保存（読み込み時の再計算を避ける）"""
+        if self._lt_embeddings is None:
+            return
+        os.makedirs(self.storage_path, exist_ok=True)
+        _submit_save(functools.partial(
+            _write_embeddings,
+            f"{self.storage_path}/embeddings.npz",
+            np.array([self._memory_text(m) for m in self.long_term]),
+            self._lt_embeddings.copy()
+        ))
     
     def _load_from_disk(self):
         """記憶をディスクから読み込み"""
         long_term_path = f"{self.storage_path}/long_term.json"
         
         if os.path.exists(long_term_path):
-            with open(long_term_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
+            with open(long_term_path, "rb") as f:
+                data = loads(f.read())
                 self.long_term = [LongTermMemory(**m) for m in data]
+        
+        # スナップショット以降の変更を追記ログから再生
+        wal_path = f"{self.storage_path}/long_term.jsonl"
+        if os.path.exists(wal_path):
+            by_key = {m.key: m for m in self.long_term}
+            with open(wal_path, "rb") as f:
+                for line in f:
+                    try:
+                        record = loads(line)
+                    except ValueError:
+                        break  # 書き込み途中で終了した行
+                    if record["op"] == "put":
+                        by_key[record["memory"]["key"]] = LongTermMemory(**record["memory"])
+                    else:
+                        by_key.pop(record["key"], None)
+                    self._wal_size += 1
+            self.long_term = list(by_key.values())
+        
+        # 保存済みのembeddingを使う（保存後に変わった記憶の分だけまとめて計算し直す）
+        embeddings_path = f"{self.storage_path}/embeddings.npz"
+        if (
+            SentenceTransformer is not None
+            and config.ENABLE_EMBEDDING_RETRIEVAL
+            and self.long_term
+            and os.path.exists(embeddings_path)
+        ):
+            with np.load(embeddings_path) as data:
+                stored = dict(zip(data["texts"].tolist(), data["vectors"]))
+            texts = [self._memory_text(m) for m in self.long_term]
+            missing = list(dict.fromkeys(t for t in texts if t not in stored))
+            if missing:
+                stored.update(zip(missing, self._encode(missing)))
+            self._lt_embeddings = np.stack([stored[t] for t in texts])
+            if missing:
+                self._save_embeddings()
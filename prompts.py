@@ -3,43 +3,43 @@ Proactive AI Friend - Prompt Templates
 思考生成、動機づけ評価、応答生成のプロンプト
 """
 
+import functools
+from string import Formatter
+from typing import Optional
+
 import config
 
 # =============================================================================
 # システムプロンプト（ベース）
 # =============================================================================
 
+# 固定部分を先頭に置き、ユーザーごとに変わる記憶は末尾に置く（プロンプトキャッシュ対策）
 SYSTEM_PROMPT_BASE = f"""
 {config.AI_PERSONA}
 
-## ユーザーについて覚えていること
-{{user_memories}}
-
 ## 重要なルール
 - 自然な会話を心がける
 - 押しつけがましくならない
 - 相手の気持ちを尊重する
 - 質問攻めにしない
+
+## ユーザーについて覚えていること
+{{user_memories}}
 """
 
+# 各プロンプトは、固定の指示（*_SYSTEM）をsystemメッセージとして先頭に置き、
+# 会話ごとに変わる内容（*_PROMPT）をuserメッセージとして後ろに置く。
+# OpenAIのプロンプトキャッシュは先頭一致でしか効かないため。
+
 # =============================================================================
 # 思考生成プロンプト（Inner Thoughts）
 # =============================================================================
 
-THOUGHT_GENERATION_PROMPT = """
+THOUGHT_GENERATION_SYSTEM = """
 あなたはチャットボットの開発者です。「Lita」というAIキャラクターの思考パターンをシミュレートしています。
 
-## 現在の会話状況
-{conversation_context}
-
-## Litaが覚えているユーザーのこと
-{user_memories}
-
-## 保留中の思考（前に考えたけどまだ言っていないこと）
-{pending_thoughts}
-
 ## タスク
-Litaがこの会話の流れを見て、頭に浮かぶ「思考」を1つ生成してください。
+Litaが与えられた会話の流れを見て、頭に浮かぶ「思考」を1つ生成してください。
 これはLitaが実際に発言するものではなく、キャラクターの心の中の考えをシミュレートしたものです。
 
 思考の例：
@@ -49,32 +49,33 @@ Litaがこの会話の流れを見て、頭に浮かぶ「思考」を1つ生成
 - 「ちょっと話しすぎたかな。相手の話を聞こう」
 
 ## 出力形式（JSON）
-{{
+{
     "thought": "Litaの思考（1-2文）",
     "type": "思考のタイプ（empathy/information/curiosity/concern/reflection）",
     "potential_response": "もしこの思考を発言するなら、どう言うか"
-}}
+}
+"""
+
+THOUGHT_GENERATION_PROMPT = """
+## 現在の会話状況
+{conversation_context}
+
+## Litaが覚えているユーザーのこと
+{user_memories}
+
+## 保留中の思考（前に考えたけどまだ言っていないこと）
+{pending_thoughts}
 """
 
 # =============================================================================
 # 動機づけ評価プロンプト
 # =============================================================================
 
-MOTIVATION_EVALUATION_PROMPT = """
+MOTIVATION_EVALUATION_SYSTEM = f"""
 あなたはAIの「発言したい気持ち」を評価する評価者です。
+与えられた思考と会話の状況をもとに評価してください。
 
-## 評価対象の思考
-{thought}
-
-## 現在の会話状況
-{conversation_context}
-
-## 会話の統計
-- 最後のユーザー発言からの経過時間: {silence_duration}秒
-- 直近のAI連続発言回数: {consecutive_ai_messages}回
-- 会話の総ターン数: {total_turns}
-
-{motivation_criteria}
+{config.MOTIVATION_CRITERIA}
 
 ## 出力形式（JSON）
 {{
@@ -89,13 +90,40 @@ MOTIVATION_EVALUATION_PROMPT = """
 }}
 """
 
+MOTIVATION_EVALUATION_PROMPT = """
+## 評価対象の思考
+{thought}
+
+## 現在の会話状況
+{conversation_context}
+
+## 会話の統計
+- 最後のユーザー発言からの経過時間: {silence_duration}秒
+- 直近のAI連続発言回数: {consecutive_ai_messages}回
+- 会話の総ターン数: {total_turns}
+"""
+
 # =============================================================================
 # 自発的発言プロンプト（Proactive Response）
 # =============================================================================
 
-PROACTIVE_RESPONSE_PROMPT = """
+PROACTIVE_RESPONSE_SYSTEM = """
 あなたは友人との会話で、自分から話しかけようとしています。
 
+## タスク
+与えられた「あなたの内なる思考」を自然な形で発言に変換してください。
+
+## 重要
+- 唐突にならないように、自然な導入を
+- 押しつけがましくならない
+- 短めに（1-3文）
+- 相手が返答しやすい形で
+
+## 出力
+発言内容のみを出力してください（説明不要）
+"""
+
+PROACTIVE_RESPONSE_PROMPT = """
 ## あなたの内なる思考
 {thought}
 
@@ -108,18 +136,6 @@ PROACTIVE_RESPONSE_PROMPT = """
 ## 状況
 - 最後のユーザー発言から{silence_duration}秒経過
 - 理由: {trigger_reason}
-
-## タスク
-上記の思考を自然な形で発言に変換してください。
-
-## 重要
-- 唐突にならないように、自然な導入を
-- 押しつけがましくならない
-- 短めに（1-3文）
-- 相手が返答しやすい形で
-
-## 出力
-発言内容のみを出力してください（説明不要）
 """
 
 # =============================================================================
@@ -136,17 +152,11 @@ REACTIVE_RESPONSE_PROMPT = """
 # 記憶抽出プロンプト
 # =============================================================================
 
-MEMORY_EXTRACTION_PROMPT = """
-以下の会話から、ユーザーについて覚えておくべき重要な情報を抽出してください。
-
-## 会話
-{conversation}
-
-## 既に覚えていること
-{existing_memories}
+MEMORY_EXTRACTION_SYSTEM = """
+与えられた会話から、ユーザーについて覚えておくべき重要な情報を抽出してください。
 
 ## タスク
-新しく覚えるべき情報、または更新すべき情報を抽出してください。
+「既に覚えていること」と比べて、新しく覚えるべき情報、または更新すべき情報を抽出してください。
 
 情報のカテゴリ例:
 - 名前/ニックネーム
@@ -159,33 +169,32 @@ MEMORY_EXTRACTION_PROMPT = """
 
 ## 出力形式（JSON配列）
 [
-    {{
+    {
         "key": "カテゴリ名",
         "content": "覚える内容",
         "importance": 1-5の重要度
-    }}
+    }
 ]
 
 新しい情報がない場合は空配列 [] を返してください。
 """
 
+MEMORY_EXTRACTION_PROMPT = """
+## 会話
+{conversation}
+
+## 既に覚えていること
+{existing_memories}
+"""
+
 # =============================================================================
 # 沈黙時の話しかけプロンプト
 # =============================================================================
 
-SILENCE_BREAK_PROMPT = """
+SILENCE_BREAK_SYSTEM = """
 あなたは友人との会話で、しばらく沈黙が続いています。
 自然に会話を再開するための発言を考えてください。
 
-## ユーザーについて覚えていること
-{user_memories}
-
-## 最後の会話内容
-{last_conversation}
-
-## 沈黙時間
-{silence_duration}秒（約{silence_minutes}分）
-
 ## タスク
 自然に会話を再開する発言を生成してください。
 
@@ -205,13 +214,48 @@ SILENCE_BREAK_PROMPT = """
 発言内容のみを出力してください（説明不要）
 """
 
+SILENCE_BREAK_PROMPT = """
+## ユーザーについて覚えていること
+{user_memories}
+
+## 最後の会話内容
+{last_conversation}
+
+## 沈黙時間
+{silence_duration}秒（約{silence_minutes}分）
+"""
+
 # =============================================================================
 # ヘルパー関数
 # =============================================================================
 
+def _compile(template: str) -> tuple[tuple[str, Optional[str]], ...]:
+    """テンプレートを (直前の固定文字列, フィールド名) の並びに分解する（毎回のformat解析を省く）"""
+    return tuple((literal, field) for literal, field, _, _ in Formatter().parse(template))
+
+
+def _render(parts: tuple[tuple[str, Optional[str]], ...], values: dict) -> str:
+    """分解済みのテンプレートに値を埋め込む"""
+    return "".join(
+        literal if field is None else literal + str(values[field])
+        for literal, field in parts
+    )
+
+
+# 起動時に一度だけ分解しておく
+# システムプロンプトは差し込む箇所が記憶の1つだけなので、前後の固定文字列をつなぐだけにする
+(_SYSTEM_PROMPT_PREFIX, _), (_SYSTEM_PROMPT_SUFFIX, _) = _compile(SYSTEM_PROMPT_BASE)
+_THOUGHT_GENERATION_PARTS = _compile(THOUGHT_GENERATION_PROMPT)
+_MOTIVATION_EVALUATION_PARTS = _compile(MOTIVATION_EVALUATION_PROMPT)
+_PROACTIVE_RESPONSE_PARTS = _compile(PROACTIVE_RESPONSE_PROMPT)
+_MEMORY_EXTRACTION_PARTS = _compile(MEMORY_EXTRACTION_PROMPT)
+_SILENCE_BREAK_PARTS = _compile(SILENCE_BREAK_PROMPT)
+
+
+@functools.lru_cache(maxsize=64)
 def format_system_prompt(user_memories: str) -> str:
-    """システムプロンプトをフォーマット"""
-    return SYSTEM_PROMPT_BASE.format(user_memories=user_memories)
+    """システムプロンプトをフォーマット（記憶が変わらない間は同じ文字列を返す）"""
+    return _SYSTEM_PROMPT_PREFIX + user_memories + _SYSTEM_PROMPT_SUFFIX
 
 
 def format_thought_generation_prompt(
@@ -220,11 +264,11 @@ def format_thought_generation_prompt(
     pending_thoughts: str
 ) -> str:
     """思考生成プロンプトをフォーマット"""
-    return THOUGHT_GENERATION_PROMPT.format(
-        conversation_context=conversation_context,
-        user_memories=user_memories,
-        pending_thoughts=pending_thoughts
-    )
+    return _render(_THOUGHT_GENERATION_PARTS, {
+        "conversation_context": conversation_context,
+        "user_memories": user_memories,
+        "pending_thoughts": pending_thoughts
+    })
 
 
 def format_motivation_evaluation_prompt(
@@ -235,14 +279,13 @@ def format_motivation_evaluation_prompt(
     total_turns: int
 ) -> str:
     """動機づけ評価プロンプトをフォーマット"""
-    return MOTIVATION_EVALUATION_PROMPT.format(
-        thought=thought,
-        conversation_context=conversation_context,
-        silence_duration=int(silence_duration),
-        consecutive_ai_messages=consecutive_ai_messages,
-        total_turns=total_turns,
-        motivation_criteria=config.MOTIVATION_CRITERIA
-    )
+    return _render(_MOTIVATION_EVALUATION_PARTS, {
+        "thought": thought,
+        "conversation_context": conversation_context,
+        "silence_duration": int(silence_duration),
+        "consecutive_ai_messages": consecutive_ai_messages,
+        "total_turns": total_turns
+    })
 
 
 def format_proactive_response_prompt(
@@ -253,13 +296,13 @@ def format_proactive_response_prompt(
     trigger_reason: str
 ) -> str:
     """自発的発言プロンプトをフォーマット"""
-    return PROACTIVE_RESPONSE_PROMPT.format(
-        thought=thought,
-        conversation_context=conversation_context,
-        user_memories=user_memories,
-        silence_duration=int(silence_duration),
-        trigger_reason=trigger_reason
-    )
+    return _render(_PROACTIVE_RESPONSE_PARTS, {
+        "thought": thought,
+        "conversation_context": conversation_context,
+        "user_memories": user_memories,
+        "silence_duration": int(silence_duration),
+        "trigger_reason": trigger_reason
+    })
 
 
 def format_memory_extraction_prompt(
@@ -267,10 +310,10 @@ def format_memory_extraction_prompt(
     existing_memories: str
 ) -> str:
     """記憶抽出プロンプトをフォーマット"""
-    return MEMORY_EXTRACTION_PROMPT.format(
-        conversation=conversation,
-        existing_memories=existing_memories
-    )
+    return _render(_MEMORY_EXTRACTION_PARTS, {
+        "conversation": conversation,
+        "existing_memories": existing_memories
+    })
 
 
 def format_silence_break_prompt(
@@ -279,9 +322,9 @@ def format_silence_break_prompt(
     silence_duration: float
 ) -> str:
     """沈黙破りプロンプトをフォーマット"""
-    return SILENCE_BREAK_PROMPT.format(
-        user_memories=user_memories,
-        last_conversation=last_conversation,
-        silence_duration=int(silence_duration),
-        silence_minutes=int(silence_duration / 60)
-    )
+    return _render(_SILENCE_BREAK_PARTS, {
+        "user_memories": user_memories,
+        "last_conversation": last_conversation,
+        "silence_duration": int(silence_duration),
+        "silence_minutes": int(silence_duration / 60)
+    })
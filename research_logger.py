@@ -3,17 +3,20 @@ Proactive AI Friend - Research Logger
 研究用のデータ収集とログ管理
 """
 
+import atexit
 import os
 import json
 import csv
 from datetime import datetime
-from typing import Optional
-from dataclasses import dataclass, asdict
+from typing import Any, Optional, TextIO
+from dataclasses import dataclass, asdict, fields
+from collections import Counter, deque
 
 import config
+from json_utils import dumps
 
 
-@dataclass
+@dataclass(slots=True)
 class ConversationLog:
     """会話ログエントリ"""
     timestamp: str
@@ -24,7 +27,7 @@ class ConversationLog:
     metadata: dict
 
 
-@dataclass
+@dataclass(slots=True)
 class ThoughtLog:
     """思考ログエントリ"""
     timestamp: str
@@ -38,7 +41,7 @@ class ThoughtLog:
     response_if_expressed: Optional[str]
 
 
-@dataclass
+@dataclass(slots=True)
 class InteractionMetrics:
     """インタラクション指標"""
     session_id: str
@@ -54,6 +57,16 @@ class InteractionMetrics:
     intervention_acceptance_rate: float  # 介入後にユーザーが返答した割合
 
 
+# CSVに書くログの列名と、JSON文字列にして書くdict型の列（行ごとにasdictしなくて済むよう事前に調べておく）
+_CSV_COLUMNS: dict[type, tuple[tuple[str, ...], frozenset[str]]] = {
+    cls: (
+        tuple(f.name for f in fields(cls)),
+        frozenset(f.name for f in fields(cls) if f.type is dict)
+    )
+    for cls in (ConversationLog, ThoughtLog)
+}
+
+
 class ResearchLogger:
     """
     研究用ログ収集クラス
@@ -76,31 +89,51 @@ class ResearchLogger:
         os.makedirs(f"{self.log_dir}/thoughts", exist_ok=True)
         os.makedirs(f"{self.log_dir}/metrics", exist_ok=True)
         
-        # セッション内のログ
-        self.conversation_logs: list[ConversationLog] = []
-        self.thought_logs: list[ThoughtLog] = []
+        # セッション内のログ（直近分のみ。全件はCSVに残る）
+        self.conversation_logs: deque[ConversationLog] = deque(maxlen=config.MAX_IN_MEMORY_LOGS)
+        self.thought_logs: deque[ThoughtLog] = deque(maxlen=config.MAX_IN_MEMORY_LOGS)
         
-        # 指標計算用
-        self.user_message_times: list[datetime] = []
-        self.ai_response_times: list[datetime] = []
+        # 指標計算用（ログを走査せずに済むよう、記録のたびに積み上げる）
+        self.user_messages: int = 0
+        self.reactive_responses: int = 0
         self.proactive_interventions: int = 0
+        self.last_user_message_time: Optional[datetime] = None
+        self.user_interval_sum: float = 0.0
+        self.user_interval_count: int = 0
+        
+        # 思考の統計用（ログが捨てられてもセッション全体の値を保つ）
+        self.total_thoughts: int = 0
+        self.expressed_thoughts: int = 0
+        self.motivation_score_sum: float = 0.0
+        self.max_motivation_score: Optional[float] = None
+        self.min_motivation_score: Optional[float] = None
+        self.trigger_counts: Counter[str] = Counter()
         self.interventions_with_response: int = 0
         self.last_was_intervention: bool = False
+        
+        # 書き込み中のCSVファイル（ログ種別ごとに開いたままにし、毎回openしない）
+        self._csv_files: dict[str, tuple[str, TextIO, Any]] = {}
+        atexit.register(self.close)
     
     # =========================================================================
     # 会話ログ
     # =========================================================================
     
-    def log_user_message(self, user_id: str, content: str, metadata: dict = None):
-        """ユーザーメッセージをログ"""
-        now = datetime.now()
+    def log_user_message(self, user_id: str, content: str, metadata: dict = None,
+                         timestamp: Optional[datetime] = None):
+        """ユーザーメッセージをログ（timestampは発生時刻。書き込みを後回しにする場合に渡す）"""
+        now = timestamp or datetime.now()
         
         # 介入後の返答かチェック
         if self.last_was_intervention:
             self.interventions_with_response += 1
             self.last_was_intervention = False
         
-        self.user_message_times.append(now)
+        self.user_messages += 1
+        if self.last_user_message_time is not None:
+            self.user_interval_sum += (now - self.last_user_message_time).total_seconds()
+            self.user_interval_count += 1
+        self.last_user_message_time = now
         
         log = ConversationLog(
             timestamp=now.isoformat(),
@@ -114,16 +147,18 @@ class ResearchLogger:
         self._append_to_csv("conversations", log)
     
     def log_ai_response(self, user_id: str, content: str, 
-                        is_proactive: bool, metadata: dict = None):
-        """AI応答をログ"""
-        now = datetime.now()
-        self.ai_response_times.append(now)
+                        is_proactive: bool, metadata: dict = None,
+                        timestamp: Optional[datetime] = None):
+        """AI応答をログ（timestampは発生時刻。書き込みを後回しにする場合に渡す）"""
+        now = timestamp or datetime.now()
         
         event_type = "proactive_intervention" if is_proactive else "ai_response"
         
         if is_proactive:
             self.proactive_interventions += 1
             self.last_was_intervention = True
+        else:
+            self.reactive_responses += 1
         
         log = ConversationLog(
             timestamp=now.isoformat(),
@@ -148,14 +183,15 @@ class ResearchLogger:
         motivation_score: float,
         evaluation_details: dict,
         was_expressed: bool,
-        response_if_expressed: Optional[str] = None
+        response_if_expressed: Optional[str] = None,
+        timestamp: Optional[datetime] = None
     ):
-        """思考をログ"""
+        """思考をログ（timestampは発生時刻。書き込みを後回しにする場合に渡す）"""
         if not config.LOG_THOUGHTS:
             return
         
         log = ThoughtLog(
-            timestamp=datetime.now().isoformat(),
+            timestamp=(timestamp or datetime.now()).isoformat(),
             session_id=self.session_id,
             user_id=user_id,
             thought_content=thought_content,
@@ -167,6 +203,16 @@ class ResearchLogger:
         )
         self.thought_logs.append(log)
         self._append_to_csv("thoughts", log)
+        
+        self.total_thoughts += 1
+        if was_expressed:
+            self.expressed_thoughts += 1
+        self.motivation_score_sum += motivation_score
+        if self.max_motivation_score is None or motivation_score > self.max_motivation_score:
+            self.max_motivation_score = motivation_score
+        if self.min_motivation_score is None or motivation_score < self.min_motivation_score:
+            self.min_motivation_score = motivation_score
+        self.trigger_counts[trigger_reason.partition(" ")[0]] += 1  # 最初の単語
     
     # =========================================================================
     # 指標計算
@@ -180,37 +226,32 @@ class ResearchLogger:
         avg_user_time = 0
         avg_ai_time = 0
         
-        if len(self.user_message_times) > 1:
-            intervals = [
-                (self.user_message_times[i+1] - self.user_message_times[i]).total_seconds()
-                for i in range(len(self.user_message_times) - 1)
-            ]
-            avg_user_time = sum(intervals) / len(intervals) if intervals else 0
+        if self.user_interval_count > 0:
+            avg_user_time = self.user_interval_sum / self.user_interval_count
         
         # 介入受容率
         acceptance_rate = 0
         if self.proactive_interventions > 0:
             acceptance_rate = self.interventions_with_response / self.proactive_interventions
         
-        # カウント
-        user_msgs = sum(1 for log in self.conversation_logs if log.event_type == "user_message")
-        reactive = sum(1 for log in self.conversation_logs if log.event_type == "ai_response")
-        proactive = sum(1 for log in self.conversation_logs if log.event_type == "proactive_intervention")
-        
         return InteractionMetrics(
             session_id=self.session_id,
             user_id=user_id,
             start_time=self.start_time.isoformat(),
             end_time=now.isoformat(),
-            total_turns=len(self.conversation_logs),
-            user_messages=user_msgs,
-            ai_reactive_responses=reactive,
-            ai_proactive_interventions=proactive,
+            total_turns=self._total_turns(),
+            user_messages=self.user_messages,
+            ai_reactive_responses=self.reactive_responses,
+            ai_proactive_interventions=self.proactive_interventions,
             avg_user_response_time=avg_user_time,
             avg_ai_response_time=avg_ai_time,
             intervention_acceptance_rate=acceptance_rate
         )
     
+    def _total_turns(self) -> int:
+        """セッション中の全発言数"""
+        return self.user_messages + self.reactive_responses + self.proactive_interventions
+    
     def save_session_metrics(self, user_id: str):
         """セッション終了時に指標を保存"""
         metrics = self.calculate_metrics(user_id)
@@ -230,29 +271,22 @@ class ResearchLogger:
     
     def get_thought_statistics(self) -> dict:
         """思考の統計を取得"""
-        if not self.thought_logs:
+        if not self.total_thoughts:
             return {}
         
-        scores = [log.motivation_score for log in self.thought_logs]
-        expressed = sum(1 for log in self.thought_logs if log.was_expressed)
-        
         return {
-            "total_thoughts": len(self.thought_logs),
-            "expressed_thoughts": expressed,
-            "expression_rate": expressed / len(self.thought_logs),
-            "avg_motivation_score": sum(scores) / len(scores),
-            "max_motivation_score": max(scores),
-            "min_motivation_score": min(scores),
+            "total_thoughts": self.total_thoughts,
+            "expressed_thoughts": self.expressed_thoughts,
+            "expression_rate": self.expressed_thoughts / self.total_thoughts,
+            "avg_motivation_score": self.motivation_score_sum / self.total_thoughts,
+            "max_motivation_score": self.max_motivation_score,
+            "min_motivation_score": self.min_motivation_score,
             "triggers": self._count_triggers()
         }
     
     def _count_triggers(self) -> dict:
         """トリガー種別のカウント"""
-        triggers = {}
-        for log in self.thought_logs:
-            trigger = log.trigger_reason.split()[0]  # 最初の単語
-            triggers[trigger] = triggers.get(trigger, 0) + 1
-        return triggers
+        return dict(self.trigger_counts)
     
     # =========================================================================
     # ファイル出力
@@ -260,22 +294,41 @@ class ResearchLogger:
     
     def _append_to_csv(self, log_type: str, log_entry):
         """CSVにログを追記"""
-        date_str = datetime.now().strftime("%Y-%m-%d")
+        date_str = log_entry.timestamp[:10]  # 書き込み時ではなく発生した日のファイルに入れる
         filename = f"{self.log_dir}/{log_type}/{date_str}_{self.session_id}.csv"
         
-        file_exists = os.path.exists(filename)
-        data = asdict(log_entry)
+        columns, json_columns = _CSV_COLUMNS[type(log_entry)]
         
-        # dictフィールドをJSON文字列に変換
-        for key, value in data.items():
-            if isinstance(value, dict):
-                data[key] = json.dumps(value, ensure_ascii=False)
+        # dictフィールドはJSON文字列に変換
+        row = []
+        for name in columns:
+            value = getattr(log_entry, name)
+            row.append(dumps(value) if name in json_columns and value is not None else value)
         
-        with open(filename, "a", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=data.keys())
+        entry = self._csv_files.get(log_type)
+        if entry is None or entry[0] != filename:
+            # 初回または日付が変わったときだけファイルを開き直す
+            if entry is not None:
+                entry[1].close()
+            file_exists = os.path.exists(filename)
+            f = open(filename, "a", newline="", encoding="utf-8")
+            writer = csv.writer(f)
             if not file_exists:
-                writer.writeheader()
-            writer.writerow(data)
+                writer.writerow(columns)
+            entry = self._csv_files[log_type] = (filename, f, writer)
+        
+        entry[2].writerow(row)
+    
+    def flush(self):
+        """バッファに溜まったログをファイルに書き出す"""
+        for _, f, _ in self._csv_files.values():
+            f.flush()
+    
+    def close(self):
+        """開いているログファイルを閉じる"""
+        for _, f, _ in self._csv_files.values():
+            f.close()
+        self._csv_files.clear()
     
     def export_session_summary(self) -> dict:
         """セッションのサマリーをエクスポート"""
@@ -291,7 +344,7 @@ class ResearchLogger:
                 "max_consecutive_interventions": config.MAX_CONSECUTIVE_INTERVENTIONS
             },
             "thought_statistics": self.get_thought_statistics(),
-            "total_logs": len(self.conversation_logs)
+            "total_logs": self._total_turns()
         }
     
     def save_session_summary(self):
@@ -6,10 +6,61 @@ Proactive AI Friend - Response Classifier
 from openai import AsyncOpenAI
 from typing import Optional
 from dataclasses import dataclass
-import json
+from types import MappingProxyType
+from collections import OrderedDict
+import asyncio
+import hashlib
+import importlib.util
+import logging
 import re
 
+import httpx
+
 import config
+from json_utils import dumps, loads
+from llm_utils import dedup_call
+
+logger = logging.getLogger(__name__)
+
+
+# clientを渡されなかったときに全インスタンスで共有するクライアント（初めて必要になったときに作る）
+_default_client: Optional[AsyncOpenAI] = None
+
+
+def _get_default_client() -> AsyncOpenAI:
+    """共有のOpenAIクライアントを取得（接続を使い回す。h2が入っていればHTTP/2で多重化する）"""
+    global _default_client
+    if _default_client is None:
+        _default_client = AsyncOpenAI(
+            api_key=config.OPENAI_API_KEY,
+            http_client=httpx.AsyncClient(
+                http2=importlib.util.find_spec("h2") is not None,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+                timeout=httpx.Timeout(600.0, connect=5.0),  # openaiのデフォルトと同じ
+                follow_redirects=True
+            )
+        )
+    return _default_client
+
+
+# 判定用モデルに渡す追加パラメータ
+_MODEL_OPTIONS = (
+    {"reasoning_effort": config.CLASSIFIER_REASONING_EFFORT}
+    if config.CLASSIFIER_REASONING_EFFORT else {}
+)
+
+# 明らかにリアクションで済む短文（メッセージ全体が一致したときだけ使う）
+_TRAILING = r"[。．.、,！!〜～ーっッ]*"
+_REACTION_RULES = (
+    (re.compile(rf"(おk|おけ|おっけ[ーい]?|オッケ[ーイ]?|ok|okay|了解(です)?|りょ(うかい)?|把握){_TRAILING}", re.I), "acknowledge"),
+    (re.compile(rf"(ありがと[うー]?(ございます)?|あざ[すっ]す?|さんきゅ[ーう]?|サンキュ[ーウ]?|thx|thanks|thank you){_TRAILING}", re.I), "thanks"),
+    (re.compile(rf"(わかった|なるほど(ね|です)?|たしかに|確かに){_TRAILING}"), "understood"),
+    (re.compile(r"[wｗ]+|草+|笑+", re.I), "funny"),
+    (re.compile(rf"(おやすみ(なさい)?|おやす|ねる|寝る){_TRAILING}"), "sleepy"),
+)
+
+# 句読点や記号だけのメッセージ（誤送信っぽいので何もしない）
+_NONE_RE = re.compile(r"[。．.、,・…\s]+")
 
 
 @dataclass
@@ -20,8 +71,11 @@ class ResponseDecision:
     reason: str  # 判定理由
 
 
-# よく使うリアクション
-REACTIONS = {
+# 判定のアクション
+_ACTIONS = frozenset(("reply", "react", "none"))
+
+# よく使うリアクション（読み取り専用）
+REACTIONS = MappingProxyType({
     "acknowledge": "👍",      # 了解系
     "thanks": "😊",           # ありがとう系
     "understood": "👌",       # わかった系
@@ -35,38 +89,52 @@ REACTIONS = {
     "sleepy": "😴",           # 眠い系
     "food": "🤤",             # 美味しそう系
     "eyes": "👀",             # 見てる/気になる系
+})
+
+# 判定結果の出力スキーマ（Structured Outputsでこの形のJSONだけを返させる）
+_DECISION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "action": {"type": "string", "enum": ["reply", "react", "none"]},
+        "reaction_type": {"type": ["string", "null"], "enum": [*REACTIONS, None]},
+        "reason": {"type": "string"}
+    },
+    "required": ["action", "reaction_type", "reason"],
+    "additionalProperties": False
 }
 
+_DECISION_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "response_decision", "strict": True, "schema": _DECISION_SCHEMA}
+}
 
-class ResponseClassifier:
-    """
-    メッセージに対する応答タイプを判定するクラス
-    
-    判定タイプ:
-    - reply: 返信が必要（質問、相談、話題提供など）
-    - react: リアクションで十分（了解、ありがとう、相槌など）
-    - none: 何もしなくていい（独り言、誤送信っぽいなど）
-    """
-    
-    def __init__(self):
-        self.client = AsyncOpenAI(api_key=config.OPENAI_API_KEY)
-    
-    async def classify(
-        self, 
-        message: str, 
-        conversation_context: str = ""
-    ) -> ResponseDecision:
-        """
-        メッセージの応答タイプを判定
-        """
-        prompt = f"""
-あなたは友達とのチャットで、相手のメッセージにどう反応するか判断します。
+_BATCH_DECISION_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "response_decisions",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "decisions": {
+                    "type": "array",
+                    "items": {
+                        **_DECISION_SCHEMA,
+                        "properties": {"id": {"type": "integer"}, **_DECISION_SCHEMA["properties"]},
+                        "required": ["id", *_DECISION_SCHEMA["required"]]
+                    }
+                }
+            },
+            "required": ["decisions"],
+            "additionalProperties": False
+        }
+    }
+}
 
-## 相手のメッセージ
-「{message}」
 
-## 最近の会話の流れ
-{conversation_context if conversation_context else "（なし）"}
+# 判定基準などの固定部分はsystemメッセージとして先頭に置く（OpenAIのプロンプトキャッシュは先頭一致でしか効かないため）
+CLASSIFICATION_SYSTEM = """
+あなたは友達とのチャットで、相手のメッセージにどう反応するか判断します。
 
 ## 判定基準
 
@@ -90,38 +158,124 @@ class ResponseClassifier:
 - 明らかな誤送信
 - Botへの呼びかけではなさそう
 
-## リアクションの種類
-- acknowledge: 👍（了解、OK系）
-- thanks: 😊（ありがとう系）
-- understood: 👌（わかった、なるほど系）
-- funny: 😂（面白い、笑い系）
-- sad: 🥲（悲しい、残念系）
-- love: ❤️（好き、嬉しい系）
-- cool: 🔥（すごい、かっこいい系）
-- thinking: 🤔（考え中、悩み系）
-- surprise: 😮（驚き系）
-- celebrate: 🎉（お祝い系）
-- sleepy: 😴（眠い、疲れた系）
-- food: 🤤（美味しそう系）
-- eyes: 👀（気になる、見てる系）
+## リアクションの種類（reaction_typeに使う名前と、その意味）
+- acknowledge: 了解、OK系
+- thanks: ありがとう系
+- understood: わかった、なるほど系
+- funny: 面白い、笑い系
+- sad: 悲しい、残念系
+- love: 好き、嬉しい系
+- cool: すごい、かっこいい系
+- thinking: 考え中、悩み系
+- surprise: 驚き系
+- celebrate: お祝い系
+- sleepy: 眠い、疲れた系
+- food: 美味しそう系
+- eyes: 気になる、見てる系
 
 ## 出力形式（JSON）
-{{
+{
     "action": "reply" or "react" or "none",
     "reaction_type": "リアクションの種類（actionがreactの場合のみ）",
     "reason": "判定理由（1文）"
-}}
+}
+"""
+
+# 判定ごとに変わる部分（userメッセージ）。会話の流れを先に、毎回変わる今回のメッセージを最後に置く
+CLASSIFICATION_PROMPT = """
+## 最近の会話の流れ
+{context}
+
+## 相手のメッセージ
+「{message}」
+"""
+
+# 複数メッセージをまとめて判定するときのsystemメッセージ（単体の判定と先頭を共有する）
+CLASSIFICATION_BATCH_SYSTEM = CLASSIFICATION_SYSTEM + """
+## 複数メッセージの判定
+メッセージがJSON配列（id, message, context）でまとめて与えられた場合は、それぞれを個別に判定し、次の形式で返してください:
+{"decisions": [{"id": 0, "action": "...", "reaction_type": "...", "reason": "..."}, ...]}
 """
+
+
+class ResponseClassifier:
+    """
+    メッセージに対する応答タイプを判定するクラス
+    
+    判定タイプ:
+    - reply: 返信が必要（質問、相談、話題提供など）
+    - react: リアクションで十分（了解、ありがとう、相槌など）
+    - none: 何もしなくていい（独り言、誤送信っぽいなど）
+    """
+    
+    def __init__(self, client: Optional[AsyncOpenAI] = None):
+        # 一時的なエラー（429/5xx/接続エラー・タイムアウト）はSDKのリトライに任せ、使い切ったときだけ返信扱いにする
+        self.client = (client or _get_default_client()).with_options(
+            max_retries=config.CLASSIFIER_MAX_RETRIES,
+            timeout=config.CLASSIFIER_TIMEOUT
+        )
+        
+        # 判定結果のキャッシュ（古く使われていないものから捨てる）
+        self._cache: OrderedDict[bytes, ResponseDecision] = OrderedDict()
+        
+        # 実行中の判定（同じメッセージが同時に来たら1回のAPI呼び出しを共有する）
+        self._inflight: dict[bytes, asyncio.Future] = {}
+    
+    async def classify(
+        self, 
+        message: str, 
+        conversation_context: str = ""
+    ) -> ResponseDecision:
+        """
+        メッセージの応答タイプを判定
+        """
+        decision = self._lookup(message, conversation_context)
+        if decision:
+            return decision
+        
+        # 同じ判定が実行中ならその結果を待つ
+        key = self._cache_key(message, conversation_context)
+        return await dedup_call(
+            self._inflight, key,
+            lambda: self._classify_with_llm(key, message, conversation_context)
+        )
+    
+    def classify_future(self, message: str, conversation_context: str = "") -> asyncio.Task:
+        """
+        判定をバックグラウンドで始め、結果を待つためのタスクを返す
+        
+        判定を待つ間に他の準備（履歴の取得など）を進めたいときに使う:
+            task = classifier.classify_future(message, context)
+            ...（他の処理）
+            decision = await task
+        """
+        return asyncio.create_task(self.classify(message, conversation_context))
+    
+    async def _classify_with_llm(
+        self,
+        key: bytes,
+        message: str,
+        conversation_context: str
+    ) -> ResponseDecision:
+        """LLMで判定し、成功したらキャッシュに入れる"""
+        prompt = CLASSIFICATION_PROMPT.format_map({
+            "message": message,
+            "context": conversation_context or "（なし）"
+        })
         
         try:
             response = await self.client.chat.completions.create(
-                model=config.LLM_MODEL,
-                max_completion_tokens=config.MAX_COMPLETION_TOKENS,
-                messages=[{"role": "user", "content": prompt}]
+                model=config.CLASSIFIER_MODEL,
+                max_completion_tokens=config.CLASSIFIER_MAX_TOKENS,
+                response_format=_DECISION_FORMAT,
+                messages=[
+                    {"role": "system", "content": CLASSIFICATION_SYSTEM},
+                    {"role": "user", "content": prompt}
+                ],
+                **_MODEL_OPTIONS
             )
             
-            text = response.choices[0].message.content
-            result = self._extract_json(text)
+            result = self._parse(response.choices[0].message.content)
             
             if not result:
                 # パース失敗時はデフォルトで返信
@@ -131,18 +285,12 @@ class ResponseClassifier:
                     reason="Parse error - defaulting to reply"
                 )
             
-            action = result.get("action", "reply")
-            reaction_type = result.get("reaction_type")
-            reaction = REACTIONS.get(reaction_type) if reaction_type else None
-            
-            return ResponseDecision(
-                action=action,
-                reaction=reaction,
-                reason=result.get("reason", "")
-            )
+            decision = self._to_decision(result)
+            self._remember(key, decision)
+            return decision
             
         except Exception as e:
-            print(f"Classification error: {e}")
+            logger.exception("Classification error")
             # エラー時はデフォルトで返信
             return ResponseDecision(
                 action="reply",
@@ -150,29 +298,312 @@ class ResponseClassifier:
                 reason=f"Error: {str(e)}"
             )
     
-    def _extract_json(self, text: str) -> Optional[dict]:
-        """テキストからJSONを抽出"""
-        # コードブロック内のJSON
-        json_match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', text)
-        if json_match:
-            try:
-                return json.loads(json_match.group(1))
-            except json.JSONDecodeError:
-                pass
+    async def classify_many(self, items: list[tuple[str, str]]) -> list[ResponseDecision]:
+        """
+        複数のメッセージの応答タイプを1回のAPI呼び出しでまとめて判定
+        
+        items: (メッセージ, 最近の会話の流れ) のリスト。結果は同じ順で返す
+        """
+        decisions: list[Optional[ResponseDecision]] = [
+            self._lookup(message, context) for message, context in items
+        ]
+        
+        # ルールやキャッシュで決まらなかったものだけLLMに聞く（同じ内容は1件にまとめる）
+        pending: dict[bytes, list[int]] = {}
+        for i, (message, context) in enumerate(items):
+            if decisions[i] is None:
+                pending.setdefault(self._cache_key(message, context), []).append(i)
+        
+        if pending:
+            keys = list(pending)
+            cases = []
+            for n, key in enumerate(keys):
+                message, context = items[pending[key][0]]
+                cases.append({"id": n, "message": message, "context": context or "（なし）"})
+            
+            results = await self._classify_batch_with_llm(cases)
+            
+            for n, key in enumerate(keys):
+                result = results.get(n)
+                if result:
+                    decision = self._to_decision(result)
+                    self._remember(key, decision)
+                else:
+                    # 判定が返ってこなかったものはデフォルトで返信
+                    decision = ResponseDecision(
+                        action="reply",
+                        reaction=None,
+                        reason="Batch parse error - defaulting to reply"
+                    )
+                for i in pending[key]:
+                    decisions[i] = decision
+        
+        return decisions
+    
+    async def _classify_batch_with_llm(self, cases: list[dict]) -> dict[int, dict]:
+        """まとめてLLMで判定し、idごとの判定結果を返す（失敗したら空）"""
+        prompt = dumps(cases)
+        
+        try:
+            response = await self.client.chat.completions.create(
+                model=config.CLASSIFIER_MODEL,
+                max_completion_tokens=(
+                    config.CLASSIFIER_MAX_TOKENS + config.CLASSIFIER_BATCH_ITEM_TOKENS * len(cases)
+                ),
+                response_format=_BATCH_DECISION_FORMAT,
+                messages=[
+                    {"role": "system", "content": CLASSIFICATION_BATCH_SYSTEM},
+                    {"role": "user", "content": prompt}
+                ],
+                **_MODEL_OPTIONS
+            )
+            
+            result = self._parse(response.choices[0].message.content)
+            decisions = result.get("decisions", []) if result else []
+            return {
+                d["id"]: d for d in decisions
+                if isinstance(d, dict) and isinstance(d.get("id"), int)
+            }
+            
+        except Exception:
+            logger.exception("Batch classification error")
+            return {}
+    
+    async def classify_batch_offline(self, items: list[tuple[str, str]]) -> list[ResponseDecision]:
+        """
+        過去ログの再判定など、急がない大量の判定をBatch APIでまとめて行う（料金は通常の約半分）
+        
+        items: (メッセージ, 最近の会話の流れ) のリスト。結果は同じ順で返す
+        結果が出るまで最大24時間かかるので、会話中の判定には使わないこと
+        """
+        decisions: list[Optional[ResponseDecision]] = [
+            self._lookup(message, context) for message, context in items
+        ]
+        
+        pending: dict[bytes, list[int]] = {}
+        for i, (message, context) in enumerate(items):
+            if decisions[i] is None:
+                pending.setdefault(self._cache_key(message, context), []).append(i)
+        
+        if pending:
+            keys = list(pending)
+            lines = []
+            for n, key in enumerate(keys):
+                message, context = items[pending[key][0]]
+                prompt = CLASSIFICATION_PROMPT.format_map({
+                    "message": message,
+                    "context": context or "（なし）"
+                })
+                lines.append(dumps({
+                    "custom_id": str(n),
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": config.CLASSIFIER_MODEL,
+                        "max_completion_tokens": config.CLASSIFIER_MAX_TOKENS,
+                        "response_format": _DECISION_FORMAT,
+                        "messages": [
+                            {"role": "system", "content": CLASSIFICATION_SYSTEM},
+                            {"role": "user", "content": prompt}
+                        ],
+                        **_MODEL_OPTIONS
+                    }
+                }))
+            
+            results = await self._run_batch_job("\n".join(lines))
+            
+            for n, key in enumerate(keys):
+                result = results.get(str(n))
+                if result:
+                    decision = self._to_decision(result)
+                    self._remember(key, decision)
+                else:
+                    decision = ResponseDecision(
+                        action="reply",
+                        reaction=None,
+                        reason="Offline batch error - defaulting to reply"
+                    )
+                for i in pending[key]:
+                    decisions[i] = decision
+        
+        return decisions
+    
+    async def _run_batch_job(self, jsonl: str) -> dict[str, dict]:
+        """JSONLをBatch APIに投げて終わるまで待ち、custom_idごとの判定結果を返す（失敗したら空）"""
+        try:
+            input_file = await self.client.files.create(
+                file=("classification_batch.jsonl", jsonl.encode()),
+                purpose="batch"
+            )
+            batch = await self.client.batches.create(
+                input_file_id=input_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h"
+            )
+            while batch.status not in ("completed", "failed", "expired", "cancelled"):
+                await asyncio.sleep(config.CLASSIFIER_OFFLINE_POLL_INTERVAL)
+                batch = await self.client.batches.retrieve(batch.id)
+            
+            # 期限切れ・キャンセルでも終わった分は結果ファイルに入っている
+            if not batch.output_file_id:
+                logger.warning("Offline classification batch %s ended with %s", batch.id, batch.status)
+                return {}
+            output = await self.client.files.content(batch.output_file_id)
+            
+            results = {}
+            for line in output.text.splitlines():
+                if not line:
+                    continue
+                item = loads(line)
+                response = item.get("response") or {}
+                if response.get("status_code") != 200:
+                    continue
+                result = self._parse(response["body"]["choices"][0]["message"]["content"])
+                if result:
+                    results[item["custom_id"]] = result
+            return results
+            
+        except Exception:
+            logger.exception("Offline classification error")
+            return {}
+    
+    def _lookup(self, message: str, conversation_context: str) -> Optional[ResponseDecision]:
+        """LLMに聞かずに決まる判定（ルールまたはキャッシュ）を返す。なければNone"""
+        # 明らかな相槌・お礼などはLLMに聞かずに判定する
+        if config.ENABLE_CLASSIFIER_RULES:
+            decision = self._match_rules(message)
+            if decision:
+                return decision
         
-        # 直接JSON
+        # 同じメッセージ・同じ会話の流れなら前回の判定を使い回す
+        key = self._cache_key(message, conversation_context)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+        return cached
+    
+    @staticmethod
+    def _parse(content: Optional[str]) -> Optional[dict]:
+        """スキーマ指定の応答本文をJSONとして読む（出力が途中で切れた・拒否されたときはNone）"""
         try:
-            start_idx = text.find('{')
-            if start_idx != -1:
-                bracket_count = 0
-                for i, char in enumerate(text[start_idx:], start_idx):
-                    if char == '{':
-                        bracket_count += 1
-                    elif char == '}':
-                        bracket_count -= 1
-                        if bracket_count == 0:
-                            return json.loads(text[start_idx:i+1])
-        except (json.JSONDecodeError, ValueError):
-            pass
+            result = loads(content)
+        except (TypeError, ValueError):
+            return None
+        return result if isinstance(result, dict) else None
+    
+    @staticmethod
+    def _to_decision(result: dict) -> ResponseDecision:
+        """LLMの出力（JSON）を判定結果に変換"""
+        # 想定外のアクションはデフォルトの返信にする（知らない値をBot側に流さない）
+        action = result.get("action")
+        if action not in _ACTIONS:
+            action = "reply"
+        reaction = REACTIONS.get(result.get("reaction_type") or "")
         
+        return ResponseDecision(
+            action=action,
+            reaction=reaction,
+            reason=result.get("reason", "")
+        )
+    
+    @staticmethod
+    def _cache_key(message: str, conversation_context: str) -> bytes:
+        """キャッシュのキー（長い会話の流れをそのまま持たないようハッシュにする）"""
+        return hashlib.blake2b(
+            f"{message.strip()}\0{conversation_context}".encode(), digest_size=16
+        ).digest()
+    
+    def _remember(self, key: bytes, decision: ResponseDecision):
+        """判定結果をキャッシュに入れる（エラー時のデフォルト判定は入れない）"""
+        self._cache[key] = decision
+        if len(self._cache) > config.CLASSIFIER_CACHE_SIZE:
+            self._cache.popitem(last=False)
+    
+    @staticmethod
+    def _match_rules(message: str) -> Optional[ResponseDecision]:
+        """ルールで判定できる短文なら判定結果を返す（できなければNone）"""
+        text = message.strip()
+        if _NONE_RE.fullmatch(text):
+            return ResponseDecision(action="none", reaction=None, reason="Rule match: punctuation only")
+        for pattern, reaction_type in _REACTION_RULES:
+            if pattern.fullmatch(text):
+                return ResponseDecision(
+                    action="react",
+                    reaction=REACTIONS[reaction_type],
+                    reason=f"Rule match: {reaction_type}"
+                )
         return None
+
+
+class BatchingClassifier:
+    """
+    短時間に届いたメッセージをまとめて判定するラッパー
+    
+    ResponseClassifierと同じようにclassify()を呼べる。
+    最初のメッセージから最大CLASSIFIER_BATCH_WINDOW秒待ち、
+    CLASSIFIER_BATCH_SIZE件たまったらその時点でまとめて判定する。
+    ルールやキャッシュで決まるものは待たずにすぐ返す。
+    """
+    
+    def __init__(self, classifier: ResponseClassifier):
+        self.classifier = classifier
+        self._queue: asyncio.Queue[tuple[str, str, asyncio.Future]] = asyncio.Queue()
+        self._flusher: Optional[asyncio.Task] = None
+    
+    async def classify(
+        self,
+        message: str,
+        conversation_context: str = ""
+    ) -> ResponseDecision:
+        """メッセージの応答タイプを判定（他のメッセージとまとめてAPIに送る）"""
+        decision = self.classifier._lookup(message, conversation_context)
+        if decision:
+            return decision
+        
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+        
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((message, conversation_context, future))
+        return await future
+    
+    def classify_future(self, message: str, conversation_context: str = "") -> asyncio.Task:
+        """判定をバックグラウンドで始め、結果を待つためのタスクを返す（ResponseClassifierと同じ）"""
+        return asyncio.create_task(self.classify(message, conversation_context))
+    
+    async def _flush_loop(self):
+        """キューからまとめて取り出して判定し、それぞれの待ち手に結果を返す"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            
+            # 最初の1件から一定時間だけ、続きのメッセージを待つ
+            deadline = loop.time() + config.CLASSIFIER_BATCH_WINDOW
+            while len(batch) < config.CLASSIFIER_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            try:
+                decisions = await self.classifier.classify_many(
+                    [(message, context) for message, context, _ in batch]
+                )
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for (_, _, future), decision in zip(batch, decisions):
+                # 待ち手がキャンセル済みなら結果は捨てる
+                if not future.done():
+                    future.set_result(decision)
+    
+    def close(self):
+        """バッチ処理のタスクを止める"""
+        if self._flusher:
+            self._flusher.cancel()